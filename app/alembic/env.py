@@ -10,6 +10,7 @@ from alembic import context
 from app.db.base import Base
 from app.models.user import User
 from app.models.referral_code import ReferralCode
+from app.models.referral_tree import ReferralTree
 from app.core.settings import settings
 
 # this is the Alembic Config object, which provides
@@ -0,0 +1,59 @@
+"""referral indexes
+
+Revision ID: 5b1e0c7a9d24
+Revises: d309db21c86f
+Create Date: 2026-10-18 10:12:41.208317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1e0c7a9d24'
+down_revision: Union[str, None] = 'd309db21c86f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Перед уникальным индексом оставляем у каждого пользователя
+    # не больше одного активного кода - с самым поздним сроком действия.
+    op.execute(
+        """
+        UPDATE referral_codes SET active = false
+        WHERE active AND id NOT IN (
+            SELECT DISTINCT ON (owner_id) id FROM referral_codes
+            WHERE active
+            ORDER BY owner_id, expires_at DESC, id DESC
+        )
+        """
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_referral_codes_owner_id', 'referral_codes', ['owner_id'],
+            unique=False, postgresql_concurrently=True
+        )
+        op.create_index(
+            'uq_referral_codes_owner_id_active', 'referral_codes', ['owner_id'],
+            unique=True, postgresql_where=sa.text('active'), postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_users_invited_by_id', 'users', ['invited_by_id', 'id'],
+            unique=False, postgresql_include=['email'], postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_invited_by_id', table_name='users', postgresql_concurrently=True)
+        op.drop_index(
+            'uq_referral_codes_owner_id_active', table_name='referral_codes',
+            postgresql_concurrently=True
+        )
+        op.drop_index(
+            'ix_referral_codes_owner_id', table_name='referral_codes',
+            postgresql_concurrently=True
+        )
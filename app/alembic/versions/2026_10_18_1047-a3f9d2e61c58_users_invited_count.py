@@ -0,0 +1,40 @@
+"""users invited count
+
+Revision ID: a3f9d2e61c58
+Revises: 5b1e0c7a9d24
+Create Date: 2026-10-18 10:47:05.613092
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f9d2e61c58'
+down_revision: Union[str, None] = '5b1e0c7a9d24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'users',
+        sa.Column('invited_count', sa.Integer(), server_default='0', nullable=False)
+    )
+    op.execute(
+        """
+        UPDATE users SET invited_count = invited.count
+        FROM (
+            SELECT invited_by_id, count(*) AS count FROM users
+            WHERE invited_by_id IS NOT NULL
+            GROUP BY invited_by_id
+        ) AS invited
+        WHERE users.id = invited.invited_by_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'invited_count')
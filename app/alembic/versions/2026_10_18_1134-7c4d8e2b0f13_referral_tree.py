@@ -0,0 +1,56 @@
+"""referral tree
+
+Revision ID: 7c4d8e2b0f13
+Revises: a3f9d2e61c58
+Create Date: 2026-10-18 11:34:52.907415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c4d8e2b0f13'
+down_revision: Union[str, None] = 'a3f9d2e61c58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('referral_tree',
+    sa.Column('ancestor_id', sa.Integer(), nullable=False),
+    sa.Column('descendant_id', sa.Integer(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['descendant_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+    )
+    # Заполняем замыкание по существующим users.invited_by_id.
+    op.execute(
+        """
+        WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM users
+            UNION ALL
+            SELECT tree.ancestor_id, users.id, tree.depth + 1
+            FROM tree JOIN users ON users.invited_by_id = tree.descendant_id
+        )
+        INSERT INTO referral_tree (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, depth FROM tree
+        """
+    )
+    op.create_index(
+        'ix_referral_tree_ancestor_id_depth', 'referral_tree',
+        ['ancestor_id', 'depth', 'descendant_id'], unique=False
+    )
+    op.create_index(
+        'ix_referral_tree_descendant_id_depth', 'referral_tree',
+        ['descendant_id', 'depth'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_referral_tree_descendant_id_depth', table_name='referral_tree')
+    op.drop_index('ix_referral_tree_ancestor_id_depth', table_name='referral_tree')
+    op.drop_table('referral_tree')
@@ -0,0 +1,48 @@
+"""referral code sequence
+
+Revision ID: e1b7a4c93d06
+Revises: 7c4d8e2b0f13
+Create Date: 2026-10-18 12:03:27.481930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.settings import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1b7a4c93d06'
+down_revision: Union[str, None] = '7c4d8e2b0f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Домен перестановки кодов: 2**40 значений (app.core.codegen.DOMAIN_SIZE).
+SEQUENCE_MAXVALUE = 2**40 - 1
+
+
+def upgrade() -> None:
+    # Ручные коды с префиксом сгенерированных могут совпасть с выданными сервером.
+    prefix = settings.REFCODE_GENERATED_PREFIX
+    reserved = op.get_bind().execute(
+        sa.text(
+            "SELECT code FROM referral_codes "
+            "WHERE left(code, length(:prefix)) = :prefix ORDER BY id LIMIT 10"
+        ),
+        {"prefix": prefix},
+    ).scalars().all()
+    if reserved:
+        raise RuntimeError(
+            f"Referral codes starting with the generated code prefix {prefix!r} already exist: "
+            f"{', '.join(reserved)}. Rename them or choose another REFCODE_GENERATED_PREFIX."
+        )
+    op.execute(sa.schema.CreateSequence(
+        sa.Sequence('referral_code_seq', maxvalue=SEQUENCE_MAXVALUE)
+    ))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('referral_code_seq')))
@@ -1,12 +1,15 @@
 import jwt
 from fastapi.security import OAuth2PasswordBearer
+from redis.asyncio import Redis
 from app.core.security import decode_jwt
-from app.schemas.auth import TokenData
+from app.core.redis import get_redis
+from app.core.principal_cache import principal_cache
+from app.schemas.auth import TokenData, Principal
 from app.services.user_service import UserService
 from app.services.referral_code_service import ReferralCodeService
 from app.db.session import get_db
-from app.models.user import User
 from app.models.referral_code import ReferralCode
+from app.models.loading import AUTH_PROFILE
 from fastapi import Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -14,39 +17,51 @@ from sqlalchemy.ext.asyncio import AsyncSession
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db),
+    redis_client: Redis = Depends(get_redis)
+) -> Principal:
     """
     Получает текущего пользователя на основе JWT-токена.
+    Пользователь берётся из кеша principal_cache, в бд идём только при промахе.
     Args:
         token (str): JWT-токен, полученный из заголовка Authorization.
         db (AsyncSession): Асинхронная сессия базы данных.
+        redis_client (Redis): Клиент Redis для второго уровня кеша.
     Returns:
-        User: Объект пользователя, если токен валиден и пользователь существует.
+        Principal: id и email пользователя, если токен валиден и пользователь существует.
     """
     try:
         payload = decode_jwt(token)
-        email: str = payload.get("sub")
+    except ValueError as e:
+        expired = isinstance(e.__cause__, jwt.ExpiredSignatureError)
+        detail = "Token has expired" if expired else "Invalid token"
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+
+    email: str = payload.get("sub")
+    if email is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-        if email is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    principal = await principal_cache.get(email, redis_client)
+    if principal is not None:
+        return principal
 
-        token_data = TokenData(email=email)
-        user_service = UserService(db)
-        user = await user_service.get_user_by_email(email=token_data.email)
+    token_data = TokenData(email=email)
+    user_service = UserService(db)
+    user = await user_service.get_user_by_email(email=token_data.email, profile=AUTH_PROFILE)
 
-        if user is None:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-        return user
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    principal = Principal.model_validate(user)
+    await principal_cache.set(principal, redis_client)
+    return principal
 
 
 async def check_existing_and_owner_referral_code(
     code_id: int,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ) -> ReferralCode:
     """
     Проверяет существование реферального кода и его принадлежность пользователю
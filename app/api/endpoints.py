@@ -1,15 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
-from redis import Redis
+from redis.asyncio import Redis
 
 from app.core.redis import get_redis
-from app.core.security import encode_jwt, validate_password
-from app.schemas.auth import Token
-from app.models.user import User
+from app.core.settings import settings
+from app.core.security import encode_jwt, verified_tokens
+from app.core.hashing import password_hasher, bulk_password_hasher
+from app.core.principal_cache import principal_cache
+from app.schemas.auth import Token, Principal
 from app.models.referral_code import ReferralCode
+from app.models.loading import AUTH_PROFILE, LOGIN_PROFILE
 from app.api.dependencies import get_current_user, check_existing_and_owner_referral_code
 from app.schemas.user import UserResponse, UserCreate, UserCreateByRefCode
+from app.schemas.leaderboard import LeaderboardResponse
+from app.schemas.user_import import UserImportReport
+from app.schemas.referral_tree import ReferralTreeResponse, AncestorsResponse, SubtreeSizeResponse
 from app.schemas.referral_code import (
     UserRefCodes,
     ReferralCodeResponse,
@@ -18,20 +27,30 @@ from app.schemas.referral_code import (
     ReferralCodeBase
 )
 from app.services.user_service import UserService
-from app.services.referral_code_service import ReferralCodeService
-from app.db.session import get_db
+from app.services.user_import_service import UserImportService, iter_lines
+from app.services.referral_code_service import ReferralCodeService, decode_cursor
+from app.services.referral_tree_service import ReferralTreeService
+from app.services.leaderboard_service import LeaderboardService
+from app.services.caches import refcodes_cache, referrals_cache
+from app.services.expiry_service import expiry_engine
+from app.services.referral_code_generator import referral_code_generator
+from app.services.referral_code_filter import referral_code_filter
+from app.db.session import get_db, get_read_db
 
 
 router = APIRouter()
 
 
 @router.post("/register", response_model=UserResponse)
-async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+async def register(
+    user: UserCreate,
+    db: AsyncSession = Depends(get_db)
+):
     """
     Регистрирует пользователя.
     """
     service = UserService(db)
-    db_user = await service.get_user_by_email(user.email)
+    db_user = await service.get_user_by_email(user.email, profile=AUTH_PROFILE)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -44,6 +63,7 @@ async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
 async def сreate_user_by_refcode(
     user_data: UserCreateByRefCode,
     db: AsyncSession = Depends(get_db),
+    redis_client: Redis = Depends(get_redis)
 ):
     """
     Регистрирует пользователя по реферальному коду.
@@ -51,9 +71,13 @@ async def сreate_user_by_refcode(
         user_data (UserCreateByRefCode): Данные для регистрации с реферальным кодом.
         db (AsyncSession, optional): Сессия базы данных.
         По умолчанию создаётся через Depends(get_db).
+        redis_client (Redis): Клиент Redis для сброса кеша пользователя.
     """
-    service = UserService(db)
-    new_user = await service.create_user_by_refcode(user_data)
+    service = UserService(db, redis_client)
+    try:
+        new_user = await service.create_user_by_refcode(user_data)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     if new_user is None:
         raise HTTPException(
             status_code=400,
@@ -62,6 +86,30 @@ async def сreate_user_by_refcode(
     return new_user
 
 
+@router.post("/users/import", response_model=UserImportReport)
+async def import_users(
+    request: Request,
+    import_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    db: AsyncSession = Depends(get_db),
+    redis_client: Redis = Depends(get_redis),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Массовый импорт пользователей из NDJSON или CSV в теле запроса.
+    Поля строки: email, password или hashed_password (bcrypt), referral_code.
+    Доступен только пользователям из USER_IMPORT_ADMINS.
+    Ошибки возвращаются построчно, остальные строки импортируются.
+    """
+    if current_user.email not in settings.USER_IMPORT_ADMINS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not allowed to import users"
+        )
+
+    service = UserImportService(db, redis_client)
+    return await service.import_lines(iter_lines(request.stream()), import_format)
+
+
 @router.post("/login", response_model=Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
@@ -75,8 +123,8 @@ async def login(
         По умолчанию создаётся через Depends(get_db).
     """
     user_service = UserService(db)
-    user = await user_service.get_user_by_email(form_data.username)
-    if not user or not validate_password(form_data.password, user.hashed_password):
+    user = await user_service.get_user_by_email(form_data.username, profile=LOGIN_PROFILE)
+    if not user or not await password_hasher.verify(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -91,51 +139,162 @@ async def create_referral_code(
     code_data: ReferralCodeCreate,
     db: AsyncSession = Depends(get_db),
     redis_client: Redis = Depends(get_redis),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 
 ):
     """
-    Создание нового реферального кода
+    Создание нового реферального кода.
+    Без code сервер сгенерирует уникальный код сам.
+    Повтор кода или второй активный код - 400я ошибка.
     """
     service = ReferralCodeService(db, redis_client)
-    refcode = await service.get_referral_code_by_code(code_data.code)
-    if refcode:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Same code exists already"
-        )
-    return await service.create_referral_code(code_data, current_user_id=current_user.id)
+    try:
+        return await service.create_referral_code(code_data, current_user_id=current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
 @router.get("/refcodes", response_model=UserRefCodes)
 async def get_user_referrals(
     db: AsyncSession = Depends(get_db),
     redis_client: Redis = Depends(get_redis),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Все реферальные коды пользователя.
+    Готовый JSON из кеша отдаётся как есть, без повторной валидации и сериализации.
     """
     service = ReferralCodeService(db, redis_client)
-    return await service.get_user_referral_codes(current_user.id)
+    content = await service.get_user_referral_codes_json(current_user.id)
+    return Response(content=content, media_type="application/json")
 
 
 @router.get("/{referrer_id}/referrals", response_model=ReferralsResponse)
 async def get_invited_users_by_referrer_id(
     referrer_id: int,
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    limit: int = Query(settings.REFERRALS_PAGE_SIZE, ge=1, le=settings.REFERRALS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    redis_client: Redis = Depends(get_redis),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Пользователи, которые зарегистрировались, используя реферальный код пользователя.
+    Ответ разбит на страницы: следующую страницу возвращает запрос с cursor=next_cursor.
+    total - общее количество рефералов.
+    """
+    try:
+        after_id = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    service = ReferralCodeService(db, redis_client)
+    try:
+        content = await service.get_invited_users_by_referrer_id_json(
+            referrer_id, limit=limit, after_id=after_id
+        )
+    except ValueError:
+        raise HTTPException(status_code=404, detail="User not found")
+    return Response(content=content, media_type="application/json")
+
+
+@router.get("/{referrer_id}/referrals/export")
+async def export_invited_users_by_referrer_id(
+    referrer_id: int,
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Выгрузка всех рефералов потоком в NDJSON или CSV.
+    Доступна самому рефереру и пользователям из USER_IMPORT_ADMINS.
+    """
+    if current_user.id != referrer_id and current_user.email not in settings.USER_IMPORT_ADMINS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not allowed to export referrals of another user"
+        )
+
+    user_service = UserService(db)
+    if await user_service.get_user_by_id(referrer_id, profile=AUTH_PROFILE) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        ReferralCodeService.export_invited_users(referrer_id, export_format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="referrals-{referrer_id}.{export_format}"'
+        },
+    )
+
+
+@router.get("/{user_id}/referrals/tree", response_model=ReferralTreeResponse)
+async def get_referral_tree(
+    user_id: int,
+    max_depth: int = Query(1, ge=1, le=settings.REFERRAL_TREE_MAX_DEPTH),
+    limit: int = Query(settings.REFERRALS_PAGE_SIZE, ge=1, le=settings.REFERRALS_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Все рефералы пользователя до глубины max_depth:
+    1 - прямые рефералы, 2 - их рефералы и т.д.
+    """
+    service = ReferralTreeService(db)
+    try:
+        return await service.get_descendants(user_id, max_depth=max_depth, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="User not found")
+
+
+@router.get("/{user_id}/referrals/tree/size", response_model=SubtreeSizeResponse)
+async def get_referral_subtree_size(
+    user_id: int,
+    max_depth: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Размер дерева рефералов пользователя, при заданном max_depth - до этой глубины.
+    """
+    service = ReferralTreeService(db)
+    try:
+        return await service.get_subtree_size(user_id, max_depth=max_depth)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="User not found")
+
+
+@router.get("/{user_id}/ancestors", response_model=AncestorsResponse)
+async def get_referral_ancestors(
+    user_id: int,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Цепочка пригласивших пользователя: от прямого реферера до корня.
     """
-    service = ReferralCodeService(db)
+    service = ReferralTreeService(db)
     try:
-        return await service.get_invited_users_by_referrer_id(referrer_id)
+        return await service.get_ancestors(user_id)
     except ValueError:
         raise HTTPException(status_code=404, detail="User not found")
 
 
+@router.get("/leaderboard", response_model=LeaderboardResponse)
+async def get_leaderboard(
+    limit: int = Query(settings.LEADERBOARD_SIZE, ge=1, le=settings.LEADERBOARD_MAX_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+    redis_client: Redis = Depends(get_redis),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Топ рефереров по количеству приглашённых пользователей.
+    """
+    service = LeaderboardService(db, redis_client)
+    return await service.get_top(limit)
+
+
 @router.delete("/refcodes/{code_id}")
 async def delete_referral_code(
     db: AsyncSession = Depends(get_db),
@@ -151,9 +310,10 @@ async def delete_referral_code(
 
 @router.patch("/refcodes/{code_id}", response_model=ReferralCodeResponse)
 async def activate_referral_code(
+    code_id: int,
     db: AsyncSession = Depends(get_db),
-    referral_code: ReferralCode = Depends(check_existing_and_owner_referral_code),
-    redis_client: Redis = Depends(get_redis)
+    redis_client: Redis = Depends(get_redis),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Активация реферального кода.
@@ -162,26 +322,48 @@ async def activate_referral_code(
     то активировать код не получится. Будет 400я ошибка.
     """
     service = ReferralCodeService(db, redis_client)
-    if await service.has_user_active_referral_code(referral_code.owner_id) or \
-            referral_code.is_code_expired():
+    try:
+        return await service.activate_referral_code(code_id, owner_id=current_user.id)
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
+    except ValueError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User has an active referral code already or code is expired"
         )
-    active_referral_code = await service.activate_referral_code(referral_code)
-    return active_referral_code
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Внутренние метрики сервиса.
+    """
+    return {
+        "password_hasher": password_hasher.stats(),
+        "bulk_password_hasher": bulk_password_hasher.stats(),
+        "principal_cache": principal_cache.stats(),
+        "verified_tokens": verified_tokens.stats(),
+        "refcodes_cache": refcodes_cache.stats(),
+        "referrals_cache": referrals_cache.stats(),
+        "refcode_expiry": expiry_engine.stats(),
+        "refcode_generator": referral_code_generator.stats(),
+        "refcode_filter": referral_code_filter.stats(),
+    }
 
 
 @router.get("/refcodes/{email}", response_model=ReferralCodeBase)
 async def get_referral_code_by_email(
     email: str,
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_read_db),
+    redis_client: Redis = Depends(get_redis),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Получение активного кода пользователя по его email-у.
     """
-    service = ReferralCodeService(db)
+    service = ReferralCodeService(db, redis_client)
     referral_code = await service.get_referral_code_by_referrer_email(email)
     if referral_code is None:
         raise HTTPException(status_code=404, detail="Active referral code not found")
@@ -0,0 +1,53 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Фильтр Блума над строками.
+    Отвечает "точно нет" или "возможно есть" с вероятностью ложного
+    срабатывания не выше error_rate, пока добавлено не больше capacity элементов.
+    Порядок битов совпадает с SETBIT/GETBIT в Redis (бит 0 - старший бит байта 0),
+    поэтому массив можно зеркалировать в Redis как обычную строку.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.size = max(8, (bits + 7) // 8 * 8)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(self.size // 8)
+        self.added = 0
+
+    def positions(self, item: str) -> list[int]:
+        """Номера битов элемента (двойное хеширование одного blake2b)."""
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str) -> None:
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 0x80 >> (position & 7)
+        self.added += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (0x80 >> (position & 7))
+            for position in self.positions(item)
+        )
+
+    def load(self, data: bytes) -> None:
+        """Заменяет битовый массив (например, прочитанный из Redis)."""
+        if len(data) != len(self.bits):
+            raise ValueError("Bloom filter size mismatch")
+        self.bits = bytearray(data)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.bits)
+
+    def stats(self) -> dict:
+        return {
+            "size_bits": self.size,
+            "hash_count": self.hash_count,
+            "added": self.added,
+        }
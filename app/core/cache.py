@@ -0,0 +1,422 @@
+import asyncio
+import logging
+import math
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional, Union
+
+from redis.asyncio import Redis
+
+
+logger = logging.getLogger(__name__)
+
+# Loader возвращает значение или пару (значение, максимальный ttl).
+Loader = Callable[[], Awaitable[Union[bytes, tuple[bytes, int]]]]
+
+
+class TTLCache:
+    """
+    Ограниченный по размеру in-process кеш с вытеснением LRU и временем жизни записей.
+    Не потокобезопасен: рассчитан на использование внутри одного event loop.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Возвращает значение, если запись есть и ещё не устарела."""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Сохраняет значение. ttl может быть только короче ttl кеша."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Удаляет запись, если она есть."""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Счётчики попаданий для мониторинга."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одним ключом в одно выполнение внутри воркера.
+    Остальные вызывающие ждут результат первого.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(func())
+        self._calls[key] = future
+        future.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(future)
+
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Запись значения, только если ключ не инвалидировали, пока loader читал бд.
+SET_IF_GENERATION_SCRIPT = """
+if (redis.call("get", KEYS[2]) or "") == ARGV[3] then
+    redis.call("set", KEYS[1], ARGV[1], "EX", ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+class RecomputingCache:
+    """
+    Кеш в Redis, защищённый от одновременного пересчёта (cache stampede).
+    - Промах пересчитывается один раз: внутри воркера вызовы объединяются
+      через SingleFlight, между воркерами - через блокировку в Redis.
+    - Вероятностное раннее обновление (XFetch): чем ближе истечение и чем дольше
+      пересчёт, тем вероятнее, что запрос обновит значение заранее.
+    - stale_ttl > 0 включает режим stale-while-revalidate: после истечения значение
+      ещё stale_ttl секунд отдаётся как есть, а обновляется в фоне.
+    Значение - готовые байты (например, сериализованный JSON), хранится
+    с заголовком "<время истечения> <длительность пересчёта> ".
+    Loader может вернуть пару (значение, ttl), чтобы сократить время жизни записи,
+    например до истечения срока действия данных.
+    Инвалидация увеличивает поколение ключа; пересчёт, начатый до инвалидации,
+    своё значение не записывает, чтобы не вернуть в кеш прочитанное до изменения.
+    """
+
+    def __init__(
+        self,
+        ttl: int,
+        beta: float = 1.0,
+        stale_ttl: int = 0,
+        lock_ttl: float = 5.0,
+        lock_wait: float = 2.0,
+    ):
+        self.ttl = ttl
+        self.beta = beta
+        self.stale_ttl = stale_ttl
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self._single_flight = SingleFlight()
+        self._background: set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.early_refreshes = 0
+        self.stale_served = 0
+        self.lock_waits = 0
+
+    @staticmethod
+    def _pack(value: bytes, expires_at: float, delta: float) -> bytes:
+        return b"%.3f %.4f " % (expires_at, delta) + value
+
+    @staticmethod
+    def _unpack(raw: bytes) -> tuple[float, float, bytes]:
+        expires_at, delta, value = raw.split(b" ", 2)
+        return float(expires_at), float(delta), value
+
+    async def get_or_compute(
+        self,
+        redis_client: Redis,
+        key: str,
+        loader: Loader,
+        background_loader: Optional[Loader] = None,
+        ttl: Optional[int] = None,
+    ) -> bytes:
+        """
+        Возвращает значение по ключу, при необходимости пересчитывая его через loader.
+        background_loader не должен зависеть от сессии текущего запроса. Если он задан,
+        пересчёт через SingleFlight и фоновое обновление в режиме stale-while-revalidate
+        идут через него: результат ждут другие запросы, и отключение первого клиента
+        не должно оборвать их пересчёт.
+        """
+        value, _ = await self.get_with_expiry(redis_client, key, loader, background_loader, ttl)
+        return value
+
+    async def get_with_expiry(
+        self,
+        redis_client: Redis,
+        key: str,
+        loader: Loader,
+        background_loader: Optional[Loader] = None,
+        ttl: Optional[int] = None,
+    ) -> tuple[bytes, float]:
+        """То же, что get_or_compute, но дополнительно возвращает время истечения значения."""
+        ttl = self.ttl if ttl is None else ttl
+        shared_loader = background_loader or loader
+        raw = await redis_client.get(key)
+        if raw is None:
+            self.misses += 1
+            return await self._single_flight.do(
+                key, lambda: self._fill(redis_client, key, shared_loader, ttl)
+            )
+
+        expires_at, delta, value = self._unpack(raw)
+        now = time.time()
+        if now >= expires_at:
+            if self.stale_ttl and background_loader is not None:
+                self.stale_served += 1
+                self._refresh_in_background(redis_client, key, background_loader, ttl)
+                return value, expires_at
+            self.misses += 1
+            return await self._single_flight.do(
+                key, lambda: self._fill(redis_client, key, shared_loader, ttl)
+            )
+
+        if now - delta * self.beta * math.log(1.0 - random.random()) >= expires_at:
+            self.early_refreshes += 1
+            return await self._single_flight.do(
+                key, lambda: self._refresh(
+                    redis_client, key, shared_loader, ttl, (value, expires_at)
+                )
+            )
+
+        self.hits += 1
+        return value, expires_at
+
+    async def invalidate(self, redis_client: Redis, key: str) -> None:
+        generation_key = f"gen:{key}"
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.incr(generation_key)
+            pipe.expire(generation_key, self.ttl + self.stale_ttl)
+            await pipe.execute()
+
+    async def _compute_and_store(
+        self, redis_client: Redis, key: str, loader: Loader, ttl: int
+    ) -> tuple[bytes, float]:
+        generation_key = f"gen:{key}"
+        generation = await redis_client.get(generation_key)
+        started = time.time()
+        value = await loader()
+        if isinstance(value, tuple):
+            value, max_ttl = value
+            ttl = min(ttl, max_ttl)
+        delta = time.time() - started
+        expires_at = started + ttl
+        if ttl > 0:
+            await redis_client.eval(
+                SET_IF_GENERATION_SCRIPT, 2, key, generation_key,
+                self._pack(value, expires_at, delta), ttl + self.stale_ttl, generation or b"",
+            )
+        return value, expires_at
+
+    async def _acquire(self, redis_client: Redis, key: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        acquired = await redis_client.set(
+            f"lock:{key}", token, nx=True, px=int(self.lock_ttl * 1000)
+        )
+        return token if acquired else None
+
+    async def _release(self, redis_client: Redis, key: str, token: str) -> None:
+        await redis_client.eval(RELEASE_LOCK_SCRIPT, 1, f"lock:{key}", token)
+
+    async def _fill(
+        self, redis_client: Redis, key: str, loader: Loader, ttl: int
+    ) -> tuple[bytes, float]:
+        """Пересчёт при промахе: один воркер считает, остальные ждут его результат."""
+        token = await self._acquire(redis_client, key)
+        if token is not None:
+            try:
+                return await self._compute_and_store(redis_client, key, loader, ttl)
+            finally:
+                await self._release(redis_client, key, token)
+
+        self.lock_waits += 1
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            raw = await redis_client.get(key)
+            if raw is not None:
+                expires_at, _, value = self._unpack(raw)
+                return value, expires_at
+        return await self._compute_and_store(redis_client, key, loader, ttl)
+
+    async def _refresh(
+        self,
+        redis_client: Redis,
+        key: str,
+        loader: Loader,
+        ttl: int,
+        current: tuple[bytes, float],
+    ) -> tuple[bytes, float]:
+        """Раннее обновление: если другой воркер уже обновляет, отдаём текущее значение."""
+        token = await self._acquire(redis_client, key)
+        if token is None:
+            return current
+        try:
+            return await self._compute_and_store(redis_client, key, loader, ttl)
+        finally:
+            await self._release(redis_client, key, token)
+
+    def _refresh_in_background(
+        self, redis_client: Redis, key: str, loader: Loader, ttl: int
+    ) -> None:
+        if any(task.get_name() == key for task in self._background):
+            return
+
+        async def refresh():
+            try:
+                await self._refresh(redis_client, key, loader, ttl, (b"", 0.0))
+            except Exception:
+                logger.exception("Background refresh of %s failed", key)
+
+        task = asyncio.create_task(refresh(), name=key)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def stats(self) -> dict:
+        """Счётчики для мониторинга."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "early_refreshes": self.early_refreshes,
+            "stale_served": self.stale_served,
+            "lock_waits": self.lock_waits,
+            "coalesced": self._single_flight.coalesced,
+        }
+
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+
+class TwoTierCache:
+    """
+    Двухуровневый кеш: L1 - ограниченный in-process кеш воркера, L2 - Redis
+    с защитой от одновременного пересчёта (RecomputingCache).
+    Инвалидация удаляет ключ из Redis и рассылается через pub/sub,
+    чтобы все воркеры сбросили свой L1.
+    """
+
+    def __init__(self, l2: RecomputingCache, l1_maxsize: int, l1_ttl: float):
+        self.l1 = TTLCache(maxsize=l1_maxsize, ttl=l1_ttl)
+        self.l2 = l2
+
+    async def get_or_compute(
+        self,
+        redis_client: Redis,
+        key: str,
+        loader: Loader,
+        background_loader: Optional[Loader] = None,
+        ttl: Optional[int] = None,
+    ) -> bytes:
+        value = self.l1.get(key)
+        if value is not None:
+            return value
+        value, expires_at = await self.l2.get_with_expiry(
+            redis_client, key, loader, background_loader, ttl
+        )
+        self.l1.set(key, value, ttl=expires_at - time.time())
+        return value
+
+    async def invalidate(self, redis_client: Redis, key: str) -> None:
+        self.l1.pop(key)
+        await self.l2.invalidate(redis_client, key)
+        await redis_client.publish(INVALIDATION_CHANNEL, key)
+
+    def stats(self) -> dict:
+        return {"l1": self.l1.stats(), "l2": self.l2.stats()}
+
+
+class CacheInvalidationListener:
+    """
+    Подписка воркера на канал инвалидаций. Полученный ключ удаляется из L1
+    всех зарегистрированных кешей. После потери соединения L1 очищается целиком:
+    сообщения, пришедшие за время разрыва, потеряны.
+    """
+
+    def __init__(self, caches: list[TwoTierCache]):
+        self.caches = caches
+        self._task: Optional[asyncio.Task] = None
+        self.received = 0
+
+    def _drop(self, key: str) -> None:
+        for cache in self.caches:
+            cache.l1.pop(key)
+
+    def _drop_all(self) -> None:
+        for cache in self.caches:
+            cache.l1.clear()
+
+    async def _listen(self, redis_client: Redis) -> None:
+        while True:
+            try:
+                async with redis_client.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    self._drop_all()
+                    while True:
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True, timeout=1.0
+                        )
+                        if message is None:
+                            continue
+                        key = message["data"]
+                        if isinstance(key, bytes):
+                            key = key.decode()
+                        self.received += 1
+                        self._drop(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Cache invalidation listener failed: %s", e)
+                self._drop_all()
+                await asyncio.sleep(1.0)
+
+    def start(self, redis_client: Redis) -> None:
+        self._task = asyncio.create_task(self._listen(redis_client))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,75 @@
+"""
+Генерация коротких реферальных кодов из значений последовательности бд.
+Значение последовательности проходит через сбалансированную сеть Фейстеля
+(биекция на [0, 2**40)), поэтому коды уникальны по построению и не идут подряд,
+а результат кодируется в base62 фиксированной ширины.
+"""
+import hashlib
+import string
+
+BASE62_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+HALF_BITS = 20
+HALF_MASK = (1 << HALF_BITS) - 1
+DOMAIN_SIZE = 1 << (2 * HALF_BITS)
+FEISTEL_ROUNDS = 4
+# 62**7 > 2**40: любой элемент домена помещается в 7 символов.
+CODE_WIDTH = 7
+
+
+def base62_encode(value: int, width: int = CODE_WIDTH) -> str:
+    digits = []
+    while value:
+        value, remainder = divmod(value, 62)
+        digits.append(BASE62_ALPHABET[remainder])
+    return "".join(reversed(digits)).rjust(width, BASE62_ALPHABET[0])
+
+
+def base62_decode(code: str) -> int:
+    value = 0
+    for char in code:
+        value = value * 62 + BASE62_ALPHABET.index(char)
+    return value
+
+
+def _round_function(half: int, round_index: int, key: bytes) -> int:
+    digest = hashlib.blake2b(
+        half.to_bytes(4, "big") + bytes([round_index]), key=key, digest_size=4
+    ).digest()
+    return int.from_bytes(digest, "big") & HALF_MASK
+
+
+def _derive_key(secret: str) -> bytes:
+    return hashlib.sha256(secret.encode()).digest()
+
+
+def permute(value: int, secret: str) -> int:
+    """Обратимая перестановка [0, DOMAIN_SIZE), зависящая от secret."""
+    if not 0 <= value < DOMAIN_SIZE:
+        raise OverflowError("Sequence value is out of the code domain")
+    key = _derive_key(secret)
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for round_index in range(FEISTEL_ROUNDS):
+        left, right = right, left ^ _round_function(right, round_index, key)
+    return (left << HALF_BITS) | right
+
+
+def unpermute(value: int, secret: str) -> int:
+    """Обратная к permute."""
+    key = _derive_key(secret)
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for round_index in reversed(range(FEISTEL_ROUNDS)):
+        left, right = right ^ _round_function(left, round_index, key), left
+    return (left << HALF_BITS) | right
+
+
+def code_from_sequence(value: int, secret: str, prefix: str) -> str:
+    """Код для значения последовательности: prefix + 7 символов base62."""
+    return prefix + base62_encode(permute(value, secret))
+
+
+def sequence_from_code(code: str, secret: str, prefix: str) -> int:
+    """Значение последовательности, из которого получен код."""
+    if not code.startswith(prefix) or len(code) != len(prefix) + CODE_WIDTH:
+        raise ValueError("Not a generated referral code")
+    return unpermute(base62_decode(code[len(prefix):]), secret)
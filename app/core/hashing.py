@@ -0,0 +1,131 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from app.core.settings import settings
+from app.core.security import hash_password, hash_passwords, validate_password
+
+
+class PasswordHasherOverloaded(Exception):
+    """
+    Очередь на хеширование паролей переполнена.
+    """
+
+
+class PasswordHasher:
+    """
+    Асинхронный сервис хеширования паролей.
+    bcrypt выполняется в пуле потоков или процессов, чтобы не блокировать event loop.
+    Количество ожидающих задач ограничено max_queue: при переполнении
+    новые задачи сразу отклоняются исключением PasswordHasherOverloaded.
+    """
+
+    def __init__(self, executor_type: str, max_workers: int, max_queue: int):
+        if executor_type not in ("thread", "process"):
+            raise ValueError(f"Unknown executor type: {executor_type}")
+        self.executor_type = executor_type
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._batch_lock = asyncio.Lock()
+        self._pending = 0
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._failed = 0
+        self._busy_seconds = 0.0
+
+    def _get_executor(self) -> Executor:
+        """Пул создаётся лениво, уже внутри воркера uvicorn."""
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="password-hasher"
+                )
+        return self._executor
+
+    async def _run(self, func, *args):
+        if self._pending >= self.max_queue:
+            self._rejected += 1
+            raise PasswordHasherOverloaded("Password hasher queue is full")
+
+        self._pending += 1
+        self._submitted += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_executor(), func, *args)
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._pending -= 1
+            self._busy_seconds += time.perf_counter() - started
+        self._completed += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        """Хеширует пароль в пуле."""
+        return await self._run(hash_password, password)
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        """
+        Хеширует пачку паролей, разбивая её на max_workers частей,
+        чтобы все воркеры пула работали параллельно, а накладные расходы
+        на передачу задач в процесс не зависели от размера пачки.
+        Пачка занимает весь пул, поэтому пачки выполняются по очереди:
+        параллельный импорт ждёт освобождения пула, а не получает
+        PasswordHasherOverloaded посреди импорта.
+        """
+        if not passwords:
+            return []
+        chunk_size = -(-len(passwords) // self.max_workers)
+        chunks = [
+            passwords[i:i + chunk_size] for i in range(0, len(passwords), chunk_size)
+        ]
+        async with self._batch_lock:
+            results = await asyncio.gather(
+                *(self._run(hash_passwords, chunk) for chunk in chunks)
+            )
+        return [hashed for chunk in results for hashed in chunk]
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        """Проверяет пароль в пуле."""
+        return await self._run(validate_password, password, hashed_password)
+
+    def stats(self) -> dict:
+        """Метрики пула для мониторинга."""
+        return {
+            "executor": self.executor_type,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "pending": self._pending,
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "failed": self._failed,
+            "avg_seconds": self._busy_seconds / self._completed if self._completed else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        """Останавливает пул при завершении приложения."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    executor_type=settings.PASSWORD_HASHER_EXECUTOR,
+    max_workers=settings.PASSWORD_HASHER_WORKERS,
+    max_queue=settings.PASSWORD_HASHER_MAX_QUEUE,
+)
+
+# Отдельный пул для массового импорта, чтобы импорт не занимал очередь регистраций.
+bulk_password_hasher = PasswordHasher(
+    executor_type="process",
+    max_workers=settings.USER_IMPORT_HASH_WORKERS,
+    max_queue=settings.USER_IMPORT_HASH_WORKERS,
+)
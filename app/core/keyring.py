@@ -0,0 +1,127 @@
+import logging
+from pathlib import Path
+from typing import Callable, Optional
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed448, ed25519, rsa
+
+from app.core.settings import Settings, settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def algorithm_for_key(public_key) -> str:
+    """
+    Определяет алгоритм подписи JWT по типу открытого ключа.
+    """
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return "RS256"
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return {256: "ES256", 384: "ES384", 521: "ES512"}[public_key.curve.key_size]
+    if isinstance(public_key, (ed25519.Ed25519PublicKey, ed448.Ed448PublicKey)):
+        return "EdDSA"
+    raise ValueError(f"Unsupported key type: {type(public_key).__name__}")
+
+
+class JWTKeyring:
+    """
+    Набор ключей для подписи и проверки JWT.
+    Ключи читаются и разбираются из PEM один раз при загрузке, дальше PyJWT
+    получает готовые объекты ключей. Подписываем текущим ключом signing_kid,
+    а проверяем любым ключом из набора по заголовку kid, что позволяет
+    ротировать ключи: новый ключ подписывает, старые ещё принимаются.
+    Атрибуты:
+        signing_kid: kid ключа, которым подписываются новые токены.
+        private_key_path: Путь к закрытому ключу для подписи.
+        public_key_path: Путь к открытому ключу подписи.
+        algorithm: Алгоритм подписи (RS256, ES256, EdDSA и т.д.).
+        verify_key_paths: Дополнительные открытые ключи {kid: путь} для проверки.
+    """
+
+    def __init__(
+        self,
+        signing_kid: str,
+        private_key_path: Path,
+        public_key_path: Path,
+        algorithm: str,
+        verify_key_paths: Optional[dict[str, Path]] = None,
+    ):
+        self.signing_kid = signing_kid
+        self.private_key_path = private_key_path
+        self.public_key_path = public_key_path
+        self.algorithm = algorithm.strip()
+        self.verify_key_paths = verify_key_paths or {}
+        self._private_key = None
+        self._verify_keys: dict[str, tuple[object, str]] = {}
+        self.load()
+
+    def load(self) -> None:
+        """Читает и разбирает все ключи. Набор подменяется целиком."""
+        private_key = serialization.load_pem_private_key(
+            self.private_key_path.read_bytes(), password=None
+        )
+        verify_keys = {
+            self.signing_kid: (
+                serialization.load_pem_public_key(self.public_key_path.read_bytes()),
+                self.algorithm,
+            )
+        }
+        for kid, path in self.verify_key_paths.items():
+            if kid == self.signing_kid:
+                continue
+            public_key = serialization.load_pem_public_key(path.read_bytes())
+            verify_keys[kid] = (public_key, algorithm_for_key(public_key))
+
+        self._private_key = private_key
+        self._verify_keys = verify_keys
+
+    def reload(self, config_factory: Optional[Callable[[], Settings]] = None) -> None:
+        """
+        Перечитывает ключи без перезапуска приложения.
+        config_factory заново читает настройки, чтобы подхватить новые JWT_KID,
+        пути ключей, ALGORITHM и JWT_VERIFY_KEYS; без него перечитываются
+        только файлы ключей по прежним путям.
+        При ошибке остаются прежние настройки и набор ключей.
+        """
+        previous = (
+            self.signing_kid, self.private_key_path, self.public_key_path,
+            self.algorithm, self.verify_key_paths,
+        )
+        try:
+            if config_factory is not None:
+                config = config_factory()
+                self.signing_kid = config.JWT_KID
+                self.private_key_path = config.PRIVATE_KEY_PATH
+                self.public_key_path = config.PUBLIC_KEY_PATH
+                self.algorithm = config.ALGORITHM.strip()
+                self.verify_key_paths = config.JWT_VERIFY_KEYS
+            self.load()
+        except (OSError, ValueError) as e:
+            (
+                self.signing_kid, self.private_key_path, self.public_key_path,
+                self.algorithm, self.verify_key_paths,
+            ) = previous
+            logger.error("JWT keyring reload failed: %s", e)
+            return
+        logger.info("JWT keyring reloaded, kids: %s", ", ".join(self._verify_keys))
+
+    def signing_key(self) -> tuple[str, object, str]:
+        """Возвращает kid, закрытый ключ и алгоритм для подписи."""
+        return self.signing_kid, self._private_key, self.algorithm
+
+    def verification_key(self, kid: Optional[str]) -> Optional[tuple[object, str]]:
+        """
+        Возвращает открытый ключ и алгоритм по kid.
+        Токены без kid, выпущенные до появления набора ключей, проверяются текущим ключом.
+        """
+        return self._verify_keys.get(kid or self.signing_kid)
+
+
+keyring = JWTKeyring(
+    signing_kid=settings.JWT_KID,
+    private_key_path=settings.PRIVATE_KEY_PATH,
+    public_key_path=settings.PUBLIC_KEY_PATH,
+    algorithm=settings.ALGORITHM,
+    verify_key_paths=settings.JWT_VERIFY_KEYS,
+)
@@ -0,0 +1,67 @@
+from typing import Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.core.cache import TTLCache
+from app.core.settings import settings
+from app.schemas.auth import Principal
+
+
+class PrincipalCache:
+    """
+    Кеш аутентифицированных пользователей по subject токена (email).
+    Первый уровень - in-process TTL/LRU кеш воркера, второй - Redis.
+    Недоступность Redis не ломает аутентификацию: запрос просто уходит в бд.
+    Пользователи не изменяются и не удаляются, поэтому записи живут до истечения TTL
+    без инвалидации; до регистрации пользователя его записи в кеше быть не может.
+    """
+
+    def __init__(self, maxsize: int, local_ttl: float, redis_ttl: int):
+        self.local = TTLCache(maxsize=maxsize, ttl=local_ttl)
+        self.redis_ttl = redis_ttl
+
+    @staticmethod
+    def _key(subject: str) -> str:
+        return f"principal:{subject}"
+
+    async def get(self, subject: str, redis_client: Optional[Redis] = None) -> Optional[Principal]:
+        """Ищет пользователя сначала в памяти, затем в Redis."""
+        principal = self.local.get(subject)
+        if principal is not None:
+            return principal
+
+        if redis_client is None:
+            return None
+        try:
+            cached_data = await redis_client.get(self._key(subject))
+        except RedisError:
+            return None
+        if not cached_data:
+            return None
+
+        principal = Principal.model_validate_json(cached_data)
+        self.local.set(subject, principal)
+        return principal
+
+    async def set(self, principal: Principal, redis_client: Optional[Redis] = None) -> None:
+        """Сохраняет пользователя в оба уровня кеша."""
+        self.local.set(principal.email, principal)
+        if redis_client is None:
+            return
+        try:
+            await redis_client.setex(
+                self._key(principal.email), self.redis_ttl, principal.model_dump_json()
+            )
+        except RedisError:
+            pass
+
+    def stats(self) -> dict:
+        return self.local.stats()
+
+
+principal_cache = PrincipalCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE,
+    local_ttl=settings.PRINCIPAL_CACHE_LOCAL_TTL,
+    redis_ttl=settings.PRINCIPAL_CACHE_TTL,
+)
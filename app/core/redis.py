@@ -1,10 +1,57 @@
-from redis.asyncio import Redis
+import logging
+from typing import Optional
 
+from redis.asyncio import Redis, BlockingConnectionPool
+from redis.exceptions import RedisError
 
-async def get_redis() -> Redis:
-    return Redis(
-        host="redis",
-        port=6379,
-        db=0,
-        decode_responses=True
+from app.core.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+redis_client: Optional[Redis] = None
+
+
+async def init_redis() -> Redis:
+    """
+    Создаёт пул соединений Redis на время жизни приложения.
+    Вызывается из lifespan при старте. Ответы не декодируются:
+    кешированные JSON-байты отдаются клиенту без преобразований.
+    """
+    global redis_client
+    pool = BlockingConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        decode_responses=False,
     )
+    redis_client = Redis(connection_pool=pool)
+    try:
+        await redis_client.ping()
+    except RedisError as e:
+        logger.warning("Redis is not available at startup: %s", e)
+    return redis_client
+
+
+async def close_redis() -> None:
+    """
+    Закрывает клиент и все соединения пула при остановке приложения.
+    """
+    global redis_client
+    if redis_client is not None:
+        await redis_client.aclose(close_connection_pool=True)
+        redis_client = None
+
+
+async def get_redis() -> Redis:
+    """
+    Зависимость FastAPI: общий клиент Redis из пула приложения.
+    """
+    if redis_client is None:
+        raise RuntimeError("Redis pool is not initialized")
+    return redis_client
@@ -1,52 +1,81 @@
+import hashlib
+import time
 from datetime import datetime, timedelta, timezone
 
-from app.core.settings import settings
+from app.core.settings import Settings, settings
+from app.core.keyring import keyring, JWTKeyring
+from app.core.cache import TTLCache
 
 import jwt
 import bcrypt
 
 
-ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
-PRIVATE_KEY = settings.PRIVATE_KEY_PATH.read_text()
-PUBLIC_KEY = settings.PUBLIC_KEY_PATH.read_text()
+
+# Уже проверенные токены: sha256(токен) -> claims.
+# Запись живёт не дольше exp токена и не дольше TOKEN_CACHE_TTL.
+verified_tokens = TTLCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
 
 
 def encode_jwt(
     payload: dict,
-    private_key: str = PRIVATE_KEY,
-    algorithm: str = ALGORITHM,
+    jwt_keyring: JWTKeyring = keyring,
     expires_minutes: timedelta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 ):
     """
-    Кодирует данные в JWT токен.
+    Кодирует данные в JWT токен текущим ключом подписи.
     """
     to_encode = payload.copy()
     now = datetime.now(timezone.utc)
     expires_at = now + expires_minutes
     to_encode.update(exp=expires_at, iat=now)
-    encoded = jwt.encode(to_encode, private_key, algorithm=algorithm)
+    kid, private_key, algorithm = jwt_keyring.signing_key()
+    encoded = jwt.encode(to_encode, private_key, algorithm=algorithm, headers={"kid": kid})
     return encoded
 
 
 def decode_jwt(
     token: str,
-    public_key: str = PUBLIC_KEY,
-    algorithm=ALGORITHM
+    jwt_keyring: JWTKeyring = keyring
 ):
     """
     Декодирует JWT токен и возвращает данные.
+    Ключ проверки выбирается по заголовку kid.
+    Повторно предъявленный токен берётся из кеша verified_tokens без проверки подписи.
     """
+    token_hash = hashlib.sha256(token.encode()).digest()
+    cached_claims = verified_tokens.get(token_hash)
+    if cached_claims is not None:
+        return dict(cached_claims)
+
     try:
+        header = jwt.get_unverified_header(token)
+        verification_key = jwt_keyring.verification_key(header.get("kid"))
+        if verification_key is None:
+            raise jwt.InvalidTokenError("Unknown key id")
+        public_key, algorithm = verification_key
         decoded = jwt.decode(
             token, public_key,
             algorithms=[algorithm],
             options={"verify_exp": True}
         )
-        return decoded
     except jwt.InvalidTokenError as e:
         raise ValueError("Invalid token") from e
 
+    expires_in = decoded.get("exp", 0) - time.time()
+    verified_tokens.set(token_hash, dict(decoded), ttl=expires_in)
+    return decoded
+
+
+def reload_keys() -> None:
+    """
+    Перечитывает настройки JWT из окружения и .env, затем ключи,
+    и сбрасывает кеш проверенных токенов,
+    чтобы токены отозванных ключей перестали приниматься сразу.
+    """
+    keyring.reload(Settings)
+    verified_tokens.clear()
+
 
 def hash_password(password: str) -> bytes:
     """
@@ -58,6 +87,13 @@ def hash_password(password: str) -> bytes:
     return hashed_password.decode('utf-8')
 
 
+def hash_passwords(passwords: list[str]) -> list[str]:
+    """
+    Хеширует пачку паролей за один вызов (одна задача пула на пачку).
+    """
+    return [hash_password(password) for password in passwords]
+
+
 def validate_password(password: str, hashed_password: str) -> bool:
     """
     Проверяет, соответствует ли пароль хешированному паролю.
@@ -1,5 +1,7 @@
+from pydantic import Field
 from pydantic_settings import BaseSettings
 from pathlib import Path
+from typing import Optional
 
 
 class Settings(BaseSettings):
@@ -11,6 +13,80 @@ class Settings(BaseSettings):
     PUBLIC_KEY_PATH: Path
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
+    JWT_KID: str = "primary"
+    JWT_VERIFY_KEYS: dict[str, Path] = {}
+    TOKEN_CACHE_SIZE: int = 10000
+    TOKEN_CACHE_TTL: int = 300
+
+    DATABASE_REPLICA_URL: Optional[str] = None
+    DATABASE_ECHO: bool = False
+    DATABASE_POOL_SIZE: int = 10
+    DATABASE_MAX_OVERFLOW: int = 20
+    DATABASE_POOL_TIMEOUT: float = 30.0
+    DATABASE_POOL_RECYCLE: int = 1800
+    DATABASE_POOL_PRE_PING: bool = True
+    DATABASE_STATEMENT_CACHE_SIZE: int = 100
+
+    REDIS_HOST: str = "redis"
+    REDIS_PORT: int = 6379
+    REDIS_DB: int = 0
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: float = 5.0
+    REDIS_SOCKET_TIMEOUT: float = 2.0
+    REDIS_CONNECT_TIMEOUT: float = 2.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+
+    REFCODES_CACHE_TTL: int = 600
+    REFERRALS_CACHE_TTL: int = 300
+    REFCODE_RESOLUTION_CACHE_TTL: int = 300
+    CACHE_L1_SIZE: int = 10000
+    CACHE_L1_TTL: int = 30
+    CACHE_EARLY_REFRESH_BETA: float = 1.0
+    CACHE_STALE_TTL: int = 0
+    CACHE_LOCK_TTL: float = 5.0
+    CACHE_LOCK_WAIT: float = 2.0
+    REFERRER_CODE_CACHE_TTL: int = 600
+    REFERRER_CODE_NEGATIVE_CACHE_TTL: int = 60
+
+    REFERRALS_PAGE_SIZE: int = 50
+    REFERRALS_MAX_PAGE_SIZE: int = 500
+    REFERRALS_EXPORT_BATCH_SIZE: int = 1000
+    REFERRAL_TREE_MAX_DEPTH: int = 10
+
+    LEADERBOARD_SIZE: int = 10
+    LEADERBOARD_MAX_SIZE: int = 100
+    LEADERBOARD_REBUILD_BATCH_SIZE: int = 1000
+    LEADERBOARD_REBUILD_LOCK_TTL: int = 600
+
+    # Ключ перестановки сгенерированных кодов. Обязателен и не должен меняться:
+    # с другим ключом (или префиксом) новые коды могут совпасть с уже выданными.
+    REFCODE_GENERATOR_SECRET: str = Field(min_length=1)
+    REFCODE_GENERATED_PREFIX: str = Field(default="_", min_length=1)
+    REFCODE_POOL_SIZE: int = 1000
+    REFCODE_POOL_LOW_WATERMARK: int = 100
+
+    REFCODE_FILTER_ENABLED: bool = True
+    REFCODE_FILTER_CAPACITY: int = 1000000
+    REFCODE_FILTER_ERROR_RATE: float = 0.001
+    REFCODE_FILTER_REDIS_MIRROR: bool = True
+
+    REFCODE_EXPIRY_ENGINE_ENABLED: bool = True
+    REFCODE_EXPIRY_POLL_INTERVAL: float = 1.0
+    REFCODE_EXPIRY_SWEEP_INTERVAL: float = 300.0
+    REFCODE_EXPIRY_BATCH_SIZE: int = 500
+
+    PASSWORD_HASHER_EXECUTOR: str = "thread"
+    PASSWORD_HASHER_WORKERS: int = 4
+    PASSWORD_HASHER_MAX_QUEUE: int = 64
+
+    USER_IMPORT_ADMINS: list[str] = []
+    USER_IMPORT_BATCH_SIZE: int = 5000
+    USER_IMPORT_HASH_WORKERS: int = 4
+    USER_IMPORT_MAX_REPORTED_ERRORS: int = 1000
+
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    PRINCIPAL_CACHE_LOCAL_TTL: int = 30
+    PRINCIPAL_CACHE_TTL: int = 300
 
     class Config:
         env_file = ".env"
@@ -1,12 +1,72 @@
 from typing import AsyncGenerator
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import CompoundSelect, Select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
 from app.core.settings import settings
 
-engine = create_async_engine(settings.DATABASE_URL, echo=True)
+
+def _create_engine(url: str) -> AsyncEngine:
+    """
+    Создаёт движок с параметрами пула из настроек.
+    Для asyncpg размер кеша подготовленных выражений задаётся
+    DATABASE_STATEMENT_CACHE_SIZE (0 - за pgbouncer в режиме transaction).
+    """
+    connect_args = {}
+    if make_url(url).get_driver_name() == "asyncpg":
+        connect_args["statement_cache_size"] = settings.DATABASE_STATEMENT_CACHE_SIZE
+        connect_args["prepared_statement_cache_size"] = settings.DATABASE_STATEMENT_CACHE_SIZE
+    return create_async_engine(
+        url,
+        echo=settings.DATABASE_ECHO,
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_MAX_OVERFLOW,
+        pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+        pool_recycle=settings.DATABASE_POOL_RECYCLE,
+        pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
+engine = _create_engine(settings.DATABASE_URL)
+replica_engine = (
+    _create_engine(settings.DATABASE_REPLICA_URL) if settings.DATABASE_REPLICA_URL else engine
+)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+PIN_PRIMARY = "pin_primary"
+
+
+class RoutingSession(Session):
+    """
+    Сессия, отправляющая чтение на реплику, а запись - на primary.
+    После первой записи (или SELECT ... FOR UPDATE) сессия закрепляется за primary
+    до конца своей жизни, так что запрос видит собственные изменения и после коммита.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get(PIN_PRIMARY):
+            return engine.sync_engine
+        if isinstance(clause, (Select, CompoundSelect)) and clause._for_update_arg is None:
+            return replica_engine.sync_engine
+        self.info[PIN_PRIMARY] = True
+        return engine.sync_engine
+
+
+ReadSessionLocal = sessionmaker(
+    class_=AsyncSession, sync_session_class=RoutingSession, expire_on_commit=False
+)
+
+
+def use_primary(session: AsyncSession) -> None:
+    """
+    Закрепляет сессию за primary.
+    Нужно для чтений, результат которых попадает в общий кеш:
+    отставшая реплика не должна заполнить его устаревшими данными.
+    """
+    session.sync_session.info[PIN_PRIMARY] = True
+
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """
@@ -17,3 +77,13 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """
     async with AsyncSessionLocal() as session:
         yield session
+
+
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Сессия для маршрутов, которые в основном читают.
+    Чтение идёт на реплику (DATABASE_REPLICA_URL), запись и всё после неё - на primary.
+    Без реплики все запросы идут на primary.
+    """
+    async with ReadSessionLocal() as session:
+        yield session
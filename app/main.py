@@ -1,13 +1,66 @@
+import asyncio
+import signal
+from contextlib import asynccontextmanager
+
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
 
 from app.api.endpoints import router as api_router
+from app.core.hashing import password_hasher, bulk_password_hasher, PasswordHasherOverloaded
+from app.core.security import reload_keys
+from app.core.redis import init_redis, close_redis
+from app.core.settings import settings
+from app.services.caches import cache_invalidation_listener
+from app.services.expiry_service import expiry_engine
+from app.services.leaderboard_service import rebuild_leaderboard_if_missing
+from app.services.referral_code_filter import referral_code_filter
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Инициализация и освобождение ресурсов приложения.
+    SIGHUP перечитывает JWT ключи без перезапуска.
+    Рейтинг рефереров при первом запуске собирается в фоне и старт не задерживает.
+    """
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_keys)
+    except (NotImplementedError, AttributeError, RuntimeError):
+        pass
+    redis_client = await init_redis()
+    cache_invalidation_listener.start(redis_client)
+    referral_code_filter.start(redis_client)
+    leaderboard_task = asyncio.create_task(rebuild_leaderboard_if_missing(redis_client))
+    if settings.REFCODE_EXPIRY_ENGINE_ENABLED:
+        expiry_engine.start(redis_client)
+    yield
+    leaderboard_task.cancel()
+    try:
+        await leaderboard_task
+    except asyncio.CancelledError:
+        pass
+    await expiry_engine.stop()
+    await referral_code_filter.stop()
+    await cache_invalidation_listener.stop()
+    await close_redis()
+    password_hasher.shutdown()
+    bulk_password_hasher.shutdown()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(api_router)
 
 
+@app.exception_handler(PasswordHasherOverloaded)
+async def password_hasher_overloaded_handler(request: Request, exc: PasswordHasherOverloaded):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", reload=True)
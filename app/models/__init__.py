@@ -1,2 +1,3 @@
 from .user import User
 from .referral_code import ReferralCode
+from .referral_tree import ReferralTree
@@ -0,0 +1,34 @@
+"""
+Именованные профили загрузки пользователя.
+Связи User по умолчанию не загружаются, нужные колонки и связи
+сервисы запрашивают явно через один из профилей:
+    select(User).options(*AUTH_PROFILE)
+"""
+from sqlalchemy.orm import load_only, raiseload
+
+from app.models.user import User
+
+
+# Аутентификация: только id и email.
+AUTH_PROFILE = (
+    load_only(User.id, User.email),
+    raiseload("*"),
+)
+
+# Вход: дополнительно хеш пароля.
+LOGIN_PROFILE = (
+    load_only(User.id, User.email, User.hashed_password),
+    raiseload("*"),
+)
+
+# Реферер для списка рефералов: поля UserResponse и счётчик приглашённых.
+REFERRALS_PROFILE = (
+    load_only(User.id, User.email, User.invited_by_id, User.invited_count),
+    raiseload("*"),
+)
+
+# Строка списка рефералов: только поля UserResponse, читаются из индекса ix_users_invited_by_id.
+INVITED_USER_PROFILE = (
+    load_only(User.id, User.email, User.invited_by_id),
+    raiseload("*"),
+)
@@ -1,15 +1,22 @@
 from typing import TYPE_CHECKING
-from datetime import datetime, timezone
+from datetime import datetime
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, ForeignKey, DateTime
+from sqlalchemy import String, ForeignKey, DateTime, Index, Sequence, text
 
+from app.core.codegen import DOMAIN_SIZE
 from app.db.base import Base
 
 if TYPE_CHECKING:
     from app.models.user import User
 
 
+# Источник серверных кодов, см. app.core.codegen: значения не выходят за домен перестановки.
+referral_code_seq = Sequence(
+    "referral_code_seq", maxvalue=DOMAIN_SIZE - 1, metadata=Base.metadata
+)
+
+
 class ReferralCode(Base):
     """
     Класс для представления реферальных кодов в базе данных.
@@ -20,19 +27,21 @@ class ReferralCode(Base):
         expires_at: Дата и время истечения срока действия кода.
         owner_id: Идентификатор пользователя, которому принадлежит код.
         owner: Связь с пользователем, которому принадлежит код.
-    Методы:
-        is_code_expired(): Проверяет, истек ли срок действия кода.
+    Индексы:
+        uq_referral_codes_owner_id_active: У пользователя может быть только один активный код.
     """
     __tablename__ = "referral_codes"
+    __table_args__ = (
+        Index(
+            "uq_referral_codes_owner_id_active", "owner_id",
+            unique=True, postgresql_where=text("active"), sqlite_where=text("active")
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     code: Mapped[str] = mapped_column(String, unique=True, nullable=False)
     active: Mapped[bool] = mapped_column(default=False)
     expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
-    owner_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    owner_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True, nullable=False)
 
     owner: Mapped["User"] = relationship("User", back_populates="referral_code")
-
-    def is_code_expired(self):
-        """Обновление поля active при проверке срока реф. кода"""
-        return self.expires_at <= datetime.now(timezone.utc)
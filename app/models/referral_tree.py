@@ -0,0 +1,25 @@
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import ForeignKey, Index
+
+from app.db.base import Base
+
+
+class ReferralTree(Base):
+    """
+    Таблица замыкания (closure table) дерева приглашений.
+    Для каждого пользователя хранится строка на себя (depth = 0)
+    и по строке на каждого предка в цепочке приглашений.
+    Атрибуты:
+        ancestor_id: Идентификатор предка (кто пригласил, прямо или через других).
+        descendant_id: Идентификатор потомка.
+        depth: Расстояние между ними: 1 - прямой реферал, 2 - реферал реферала и т.д.
+    """
+    __tablename__ = "referral_tree"
+    __table_args__ = (
+        Index("ix_referral_tree_ancestor_id_depth", "ancestor_id", "depth", "descendant_id"),
+        Index("ix_referral_tree_descendant_id_depth", "descendant_id", "depth"),
+    )
+
+    ancestor_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    descendant_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    depth: Mapped[int] = mapped_column(nullable=False)
@@ -1,7 +1,7 @@
 from typing import TYPE_CHECKING
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, ForeignKey
+from sqlalchemy import String, ForeignKey, Index
 
 from app.db.base import Base
 
@@ -18,16 +18,25 @@ class User(Base):
         hashed_password: Хэшированный пароль пользователя.
         invited_by_id: Идентификатор пользователя, который пригласил текущего пользователя.
                                    Если None, пользователь не был приглашен.
+        invited_count: Количество приглашённых пользователей, обновляется при регистрации.
         referral_code: Список реферальных кодов, созданных пользователем.
         invited_users: Список пользователей, приглашенных текущим пользователем.
         invited_by: Пользователь, который пригласил текущего пользователя.
+    Связи загружаются только явно, через профили загрузки из app.models.loading.
     """
     __tablename__ = "users"
+    __table_args__ = (
+        # Покрывающий индекс: список рефералов читается только из индекса.
+        Index(
+            "ix_users_invited_by_id", "invited_by_id", "id", postgresql_include=["email"]
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     email: Mapped[str] = mapped_column(String, unique=True, index=True, nullable=False)
     hashed_password: Mapped[str] = mapped_column(String, nullable=False)
     invited_by_id: Mapped[int | None] = mapped_column(ForeignKey("users.id"), nullable=True)
+    invited_count: Mapped[int] = mapped_column(default=0, server_default="0", nullable=False)
 
     referral_code: Mapped[list["ReferralCode"]] = relationship(
         "ReferralCode", back_populates="owner"
@@ -35,12 +44,10 @@ class User(Base):
     invited_users: Mapped[list["User"]] = relationship(
         "User",
         back_populates="invited_by",
-        remote_side=[invited_by_id],
-        lazy="selectin"
+        remote_side=[invited_by_id]
     )
     invited_by: Mapped["User"] = relationship(
         "User",
         back_populates="invited_users",
-        remote_side=[id],
-        lazy="selectin"
+        remote_side=[id]
     )
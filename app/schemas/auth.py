@@ -10,6 +10,14 @@ class TokenData(BaseModel):
     email: EmailStr
 
 
+class Principal(BaseModel):
+    id: int
+    email: EmailStr
+
+    class Config:
+        from_attributes = True
+
+
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
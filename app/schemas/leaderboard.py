@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+from app.schemas.user import UserBase
+
+
+class LeaderboardEntry(UserBase):
+    id: int
+    invited_count: int
+
+
+class LeaderboardResponse(BaseModel):
+    referrers: list[LeaderboardEntry] = []
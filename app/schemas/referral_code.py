@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 from datetime import datetime
 from app.schemas.user import UserResponse
@@ -13,7 +15,8 @@ class ReferralCodeBase(BaseModel):
 
 
 class ReferralCodeCreate(ReferralCodeBase):
-    pass
+    # Без code сервер выдаёт сгенерированный код.
+    code: Optional[str] = None
 
 
 class ReferralCodeResponse(ReferralCodeBase):
@@ -27,6 +30,8 @@ class ReferralCodeResponse(ReferralCodeBase):
 class ReferralsResponse(BaseModel):
     user: UserResponse
     invited_users: list[UserResponse] = []
+    total: int = 0
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
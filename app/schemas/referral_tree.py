@@ -0,0 +1,26 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+from app.schemas.user import UserResponse
+
+
+class ReferralTreeNode(UserResponse):
+    depth: int
+
+
+class ReferralTreeResponse(BaseModel):
+    user_id: int
+    descendants: list[ReferralTreeNode] = []
+    truncated: bool = False
+
+
+class AncestorsResponse(BaseModel):
+    user_id: int
+    ancestors: list[ReferralTreeNode] = []
+
+
+class SubtreeSizeResponse(BaseModel):
+    user_id: int
+    subtree_size: int
+    max_depth: Optional[int] = None
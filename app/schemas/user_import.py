@@ -0,0 +1,38 @@
+from typing import Optional
+
+from pydantic import BaseModel, model_validator
+
+from app.schemas.user import UserBase
+
+
+class UserImportRow(UserBase):
+    """
+    Строка импорта: пароль открытым текстом или готовый bcrypt-хеш.
+    Готовый хеш не пересчитывается, поэтому импорт из другой системы
+    не упирается в стоимость bcrypt.
+    """
+    password: Optional[str] = None
+    hashed_password: Optional[str] = None
+    referral_code: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_password(self) -> "UserImportRow":
+        if (self.password is None) == (self.hashed_password is None):
+            raise ValueError("Exactly one of password and hashed_password is required")
+        if self.hashed_password is not None and not self.hashed_password.startswith(
+            ("$2a$", "$2b$", "$2y$")
+        ):
+            raise ValueError("hashed_password must be a bcrypt hash")
+        return self
+
+
+class UserImportError(BaseModel):
+    line: int
+    email: Optional[str] = None
+    error: str
+
+
+class UserImportReport(BaseModel):
+    imported: int = 0
+    failed: int = 0
+    errors: list[UserImportError] = []
@@ -0,0 +1,61 @@
+from app.core.cache import CacheInvalidationListener, RecomputingCache, TwoTierCache
+from app.core.settings import settings
+
+
+def _recomputing_cache(ttl: int) -> RecomputingCache:
+    return RecomputingCache(
+        ttl=ttl,
+        beta=settings.CACHE_EARLY_REFRESH_BETA,
+        stale_ttl=settings.CACHE_STALE_TTL,
+        lock_ttl=settings.CACHE_LOCK_TTL,
+        lock_wait=settings.CACHE_LOCK_WAIT,
+    )
+
+
+# Реферальные коды пользователя: ключ user:{owner_id}:refcodes
+refcodes_cache = TwoTierCache(
+    l2=_recomputing_cache(settings.REFCODES_CACHE_TTL),
+    l1_maxsize=settings.CACHE_L1_SIZE,
+    l1_ttl=settings.CACHE_L1_TTL,
+)
+
+# Приглашённые пользователи реферера: ключ user:{referrer_id}:referrals
+referrals_cache = TwoTierCache(
+    l2=_recomputing_cache(settings.REFERRALS_CACHE_TTL),
+    l1_maxsize=settings.CACHE_L1_SIZE,
+    l1_ttl=settings.CACHE_L1_TTL,
+)
+
+# Разрешение реферального кода в ReferralCodeResponse: ключ refcode:{code}
+refcode_resolution_cache = TwoTierCache(
+    l2=_recomputing_cache(settings.REFCODE_RESOLUTION_CACHE_TTL),
+    l1_maxsize=settings.CACHE_L1_SIZE,
+    l1_ttl=settings.CACHE_L1_TTL,
+)
+
+# Активный код реферера по email: ключ referrer:{email}:active_refcode
+referrer_code_cache = TwoTierCache(
+    l2=_recomputing_cache(settings.REFERRER_CODE_CACHE_TTL),
+    l1_maxsize=settings.CACHE_L1_SIZE,
+    l1_ttl=settings.CACHE_L1_TTL,
+)
+
+cache_invalidation_listener = CacheInvalidationListener(
+    [refcodes_cache, referrals_cache, refcode_resolution_cache, referrer_code_cache]
+)
+
+
+def user_refcodes_key(owner_id: int) -> str:
+    return f"user:{owner_id}:refcodes"
+
+
+def user_referrals_key(referrer_id: int) -> str:
+    return f"user:{referrer_id}:referrals"
+
+
+def referral_code_key(code: str) -> str:
+    return f"refcode:{code}"
+
+
+def referrer_code_key(email: str) -> str:
+    return f"referrer:{email}:active_refcode"
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from redis.asyncio import Redis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.settings import settings
+from app.db.session import AsyncSessionLocal
+from app.models.referral_code import ReferralCode
+from app.services.referral_code_service import ReferralCodeService, EXPIRY_QUEUE_KEY
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReferralCodeExpiryEngine:
+    """
+    Фоновая деактивация реферальных кодов в момент expires_at.
+    Очередь истечения - sorted set в Redis (общий для всех воркеров):
+    движок спит до ближайшего expires_at (не дольше poll_interval) и
+    деактивирует наступившие коды пачками. Раз в sweep_interval выполняется
+    полный проход по бд на случай, если очередь в Redis была потеряна.
+    """
+
+    def __init__(self, poll_interval: float, sweep_interval: float, batch_size: int):
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.expired = 0
+
+    async def rebuild_queue(self, redis_client: Redis) -> int:
+        """Заполняет очередь истечения всеми активными кодами из бд."""
+        queued = 0
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(
+                select(ReferralCode.id, ReferralCode.expires_at)
+                .where(ReferralCode.active == True)
+                .execution_options(yield_per=self.batch_size)
+            )
+            async for partition in result.partitions():
+                await redis_client.zadd(
+                    EXPIRY_QUEUE_KEY,
+                    {str(code_id): expires_at.timestamp() for code_id, expires_at in partition}
+                )
+                queued += len(partition)
+        return queued
+
+    async def expire_due(self, redis_client: Redis) -> int:
+        """
+        Деактивирует все наступившие коды и сбрасывает связанные кеши.
+        Деактивированные коды убирает из очереди expire_due_referral_codes;
+        здесь удаляются только наступившие записи кодов, которые уже не активны
+        (например, удалены), чтобы они не застревали в голове очереди.
+        """
+        async with AsyncSessionLocal() as db:
+            service = ReferralCodeService(db, redis_client)
+            expired = await service.expire_due_referral_codes(self.batch_size)
+            await self._drop_inactive(db, redis_client)
+        self.expired += expired
+        return expired
+
+    async def _drop_inactive(self, db: AsyncSession, redis_client: Redis) -> None:
+        due = await redis_client.zrangebyscore(
+            EXPIRY_QUEUE_KEY, "-inf", time.time(), start=0, num=self.batch_size
+        )
+        if not due:
+            return
+        result = await db.execute(
+            select(ReferralCode.id)
+            .where(ReferralCode.id.in_([int(code_id) for code_id in due]))
+            .where(ReferralCode.active == True)
+        )
+        active = {str(code_id).encode() for code_id in result.scalars()}
+        inactive = [code_id for code_id in due if code_id not in active]
+        if inactive:
+            await redis_client.zrem(EXPIRY_QUEUE_KEY, *inactive)
+
+    async def _next_due_in(self, redis_client: Redis) -> Optional[float]:
+        head = await redis_client.zrange(EXPIRY_QUEUE_KEY, 0, 0, withscores=True)
+        if not head:
+            return None
+        return head[0][1] - time.time()
+
+    async def run(self, redis_client: Redis) -> None:
+        queue_rebuilt = False
+        next_sweep = time.monotonic()
+        while True:
+            try:
+                if not queue_rebuilt:
+                    await self.rebuild_queue(redis_client)
+                    queue_rebuilt = True
+
+                if time.monotonic() >= next_sweep:
+                    await self.expire_due(redis_client)
+                    next_sweep = time.monotonic() + self.sweep_interval
+
+                due_in = await self._next_due_in(redis_client)
+                if due_in is not None and due_in <= 0:
+                    if await self.expire_due(redis_client):
+                        continue
+                    # Код в голове ещё активен по часам бд или занят другим воркером.
+                    due_in = None
+                delay = self.poll_interval if due_in is None else min(due_in, self.poll_interval)
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Referral code expiry failed")
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self, redis_client: Redis) -> None:
+        self._task = asyncio.create_task(self.run(redis_client))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"expired": self.expired}
+
+
+expiry_engine = ReferralCodeExpiryEngine(
+    poll_interval=settings.REFCODE_EXPIRY_POLL_INTERVAL,
+    sweep_interval=settings.REFCODE_EXPIRY_SWEEP_INTERVAL,
+    batch_size=settings.REFCODE_EXPIRY_BATCH_SIZE,
+)
+
+
+async def main() -> None:
+    """Запуск движка отдельным процессом: python -m app.services.expiry_service"""
+    from app.core.redis import init_redis, close_redis
+
+    redis_client = await init_redis()
+    try:
+        await expiry_engine.run(redis_client)
+    finally:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
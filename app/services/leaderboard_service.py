@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import uuid
+from typing import Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import RELEASE_LOCK_SCRIPT
+from app.core.settings import settings
+from app.db.session import AsyncSessionLocal
+from app.models.user import User
+from app.schemas.leaderboard import LeaderboardEntry, LeaderboardResponse
+
+
+logger = logging.getLogger(__name__)
+
+# Sorted set: member - id реферера, score - его invited_count.
+LEADERBOARD_KEY = "leaderboard:referrers"
+# Отметка о том, что рейтинг собран: пустой рейтинг в Redis не хранится.
+LEADERBOARD_BUILT_KEY = "leaderboard:referrers:built"
+# Блокировка пересборки: рейтинг пересобирает один процесс.
+LEADERBOARD_REBUILD_LOCK_KEY = "leaderboard:referrers:rebuild:lock"
+
+
+class LeaderboardService:
+    """
+    Рейтинг рефереров по количеству приглашённых.
+    Источник истины - users.invited_count, который увеличивается в транзакции
+    регистрации. Redis sorted set зеркалит его, поэтому топ читается через
+    ZREVRANGE за O(log n + limit) без GROUP BY по users.
+    В зеркало пишется закоммиченное значение счётчика через ZADD GT, а не
+    приращение: каждая запись заново синхронизирует реферера, а запоздавшая
+    запись меньшего значения ничего не портит.
+    """
+
+    def __init__(self, db: AsyncSession, redis_client: Optional[Redis] = None):
+        self.db = db
+        self.redis_client = redis_client
+
+    async def record_referral(self, referrer_id: int, invited_count: int) -> None:
+        """
+        Записывает счёт реферера после коммита регистрации:
+        invited_count - значение счётчика, возвращённое UPDATE ... RETURNING.
+        Ошибка Redis не ломает регистрацию: запись исправит следующая регистрация
+        этого реферера или rebuild().
+        """
+        await self.record_referrals({referrer_id: invited_count})
+
+    async def record_referrals(self, invited_counts: dict[int, int]) -> None:
+        """
+        Массовый вариант record_referral: {id реферера: invited_count}.
+        """
+        if self.redis_client is None or not invited_counts:
+            return
+        try:
+            await self.redis_client.zadd(
+                LEADERBOARD_KEY,
+                {str(referrer_id): count for referrer_id, count in invited_counts.items()},
+                gt=True,
+            )
+        except RedisError as e:
+            logger.warning(
+                "Leaderboard update for %s referrers failed: %s", len(invited_counts), e
+            )
+
+    async def get_top(self, limit: int) -> LeaderboardResponse:
+        """
+        Топ рефереров по убыванию invited_count.
+        Email подтягивается из бд по первичному ключу только для попавших в топ.
+        """
+        top = await self.redis_client.zrevrange(LEADERBOARD_KEY, 0, limit - 1, withscores=True)
+        if not top:
+            return LeaderboardResponse()
+
+        ids = [int(member) for member, _ in top]
+        result = await self.db.execute(select(User.id, User.email).where(User.id.in_(ids)))
+        emails = dict(result.all())
+        return LeaderboardResponse(
+            referrers=[
+                LeaderboardEntry(id=user_id, email=emails[user_id], invited_count=int(score))
+                for user_id, (_, score) in zip(ids, top)
+                if user_id in emails
+            ]
+        )
+
+    async def rebuild(
+        self,
+        batch_size: int = settings.LEADERBOARD_REBUILD_BATCH_SIZE,
+        if_missing: bool = False,
+    ) -> Optional[int]:
+        """
+        Пересобирает рейтинг из users.invited_count.
+        Одновременно рейтинг пересобирает только один процесс (блокировка в Redis
+        на LEADERBOARD_REBUILD_LOCK_TTL), иначе снимки разных процессов затирали бы
+        друг друга. Если пересборка уже идёт, возвращает None.
+        if_missing - пересобрать, только если рейтинг ещё не собран: отметка
+        проверяется под блокировкой, чтобы не повторять только что законченную сборку.
+        Новый sorted set собирается под временным ключом и атомарно
+        подменяет старый через RENAME, так что читатели не видят пустой рейтинг.
+        Записи регистраций, закоммиченных после начала чтения users и до RENAME,
+        попадают в старый ключ и затираются снимком: такой реферер отстаёт
+        в рейтинге до своей следующей регистрации, которая запишет актуальный
+        invited_count. rebuild() безопасно повторять.
+        После пересборки ставится отметка LEADERBOARD_BUILT_KEY, в том числе
+        для пустого рейтинга, чтобы rebuild_if_missing() не пересобирал его на каждом старте.
+        """
+        token = uuid.uuid4().hex
+        if not await self.redis_client.set(
+            LEADERBOARD_REBUILD_LOCK_KEY, token, nx=True, ex=settings.LEADERBOARD_REBUILD_LOCK_TTL
+        ):
+            return None
+        try:
+            if if_missing and await self.redis_client.exists(LEADERBOARD_BUILT_KEY):
+                return 0
+            return await self._rebuild(batch_size)
+        finally:
+            await self.redis_client.eval(
+                RELEASE_LOCK_SCRIPT, 1, LEADERBOARD_REBUILD_LOCK_KEY, token
+            )
+
+    async def _rebuild(self, batch_size: int) -> int:
+        tmp_key = f"{LEADERBOARD_KEY}:rebuild:{uuid.uuid4().hex}"
+        total = 0
+        result = await self.db.stream(
+            select(User.id, User.invited_count)
+            .where(User.invited_count > 0)
+            .execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions():
+            await self.redis_client.zadd(
+                tmp_key, {str(user_id): invited_count for user_id, invited_count in partition}
+            )
+            total += len(partition)
+
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            if total:
+                pipe.rename(tmp_key, LEADERBOARD_KEY)
+            else:
+                pipe.delete(LEADERBOARD_KEY)
+            pipe.set(LEADERBOARD_BUILT_KEY, 1)
+            await pipe.execute()
+        return total
+
+    async def rebuild_if_missing(self) -> None:
+        """Собирает рейтинг, если он ещё не собирался и его не собирает другой процесс."""
+        try:
+            if await self.redis_client.exists(LEADERBOARD_BUILT_KEY):
+                return
+            total = await self.rebuild(if_missing=True)
+        except (RedisError, SQLAlchemyError) as e:
+            logger.warning("Leaderboard rebuild failed: %s", e)
+            return
+        if total is None:
+            logger.info("Leaderboard is being rebuilt by another process")
+            return
+        logger.info("Leaderboard rebuilt, referrers: %s", total)
+
+
+async def rebuild_leaderboard_if_missing(redis_client: Redis) -> None:
+    """
+    Сборка рейтинга при старте приложения в фоне, в своей сессии:
+    воркеры начинают обслуживать запросы, не дожидаясь чтения users.
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            await LeaderboardService(db, redis_client).rebuild_if_missing()
+    except Exception:
+        logger.exception("Leaderboard rebuild failed")
+
+
+async def main() -> None:
+    """Пересборка рейтинга из бд: python -m app.services.leaderboard_service"""
+    from app.core.redis import init_redis, close_redis
+
+    redis_client = await init_redis()
+    try:
+        async with AsyncSessionLocal() as db:
+            total = await LeaderboardService(db, redis_client).rebuild()
+        if total is None:
+            print("Leaderboard is being rebuilt by another process")
+        else:
+            print(f"Leaderboard rebuilt, referrers: {total}")
+    finally:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
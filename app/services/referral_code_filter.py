@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import uuid
+from typing import Callable, Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.bloom import BloomFilter
+from app.core.settings import settings
+from app.db.session import AsyncSessionLocal
+from app.models.referral_code import ReferralCode
+
+
+logger = logging.getLogger(__name__)
+
+# Зеркало битового массива в Redis и канал рассылки новых кодов между воркерами.
+REFCODE_FILTER_KEY = "refcodes:bloom"
+REFCODE_FILTER_CHANNEL = "refcodes:bloom:add"
+# Команда воркерам перестроить фильтр из бд: код не удалось разослать.
+REFCODE_FILTER_RESET_CHANNEL = "refcodes:bloom:reset"
+
+
+class ReferralCodeFilter:
+    """
+    Фильтр Блума всех существующих реферальных кодов.
+    Регистрация по коду сначала спрашивает фильтр: на заведомо несуществующий
+    код ответ даётся из памяти воркера, без bcrypt и запросов в бд.
+    Фильтр строится в фоне при старте: из зеркала в Redis, а если его нет - из бд.
+    Новые коды добавляются в зеркало и рассылаются воркерам через pub/sub.
+    При промахе в памяти проверяется зеркало, так что код, созданный в другом
+    воркере, виден и до получения сообщения.
+    Удалённые коды из фильтра не удаляются: это лишь ложные срабатывания,
+    которые отсекает запрос в бд.
+    Пока фильтр не построен или Redis недоступен, проверка пропускает все коды.
+    Если новый код не удалось записать в зеркало или разослать, зеркало
+    удаляется и все воркеры перестраивают фильтр из бд, иначе остальные
+    воркеры отвергали бы существующий код.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        error_rate: float,
+        redis_mirror: bool,
+        enabled: bool = True,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.redis_mirror = redis_mirror
+        self.enabled = enabled
+        self.session_factory = session_factory
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.ready = False
+        self._task: Optional[asyncio.Task] = None
+        self._reset_task: Optional[asyncio.Task] = None
+        self.checks = 0
+        self.rejected = 0
+
+    async def might_exist(self, code: str, redis_client: Optional[Redis] = None) -> bool:
+        """False - кода точно нет, True - код, возможно, есть."""
+        if not self.enabled or not self.ready:
+            return True
+        self.checks += 1
+        if code in self.bloom:
+            return True
+        if self.redis_mirror and redis_client is not None:
+            try:
+                if await self._in_mirror(redis_client, code):
+                    self.bloom.add(code)
+                    return True
+            except RedisError:
+                return True
+        self.rejected += 1
+        return False
+
+    async def _in_mirror(self, redis_client: Redis, code: str) -> bool:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for position in self.bloom.positions(code):
+                pipe.getbit(REFCODE_FILTER_KEY, position)
+            return all(await pipe.execute())
+
+    async def add(self, code: str, redis_client: Optional[Redis] = None) -> None:
+        """Добавляет новый код в фильтр воркера, в зеркало и рассылает остальным."""
+        self.bloom.add(code)
+        if redis_client is None:
+            return
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                if self.redis_mirror:
+                    for position in self.bloom.positions(code):
+                        pipe.setbit(REFCODE_FILTER_KEY, position, 1)
+                pipe.publish(REFCODE_FILTER_CHANNEL, code)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Referral code filter update failed, resetting: %s", e)
+            if self._reset_task is None or self._reset_task.done():
+                self._reset_task = asyncio.create_task(self._reset(redis_client))
+
+    async def _reset(self, redis_client: Redis) -> None:
+        """
+        Удаляет зеркало и просит все воркеры перестроить фильтр из бд.
+        Повторяется, пока Redis не ответит: до этого код есть только у этого воркера.
+        """
+        delay = 1.0
+        while True:
+            try:
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    pipe.delete(REFCODE_FILTER_KEY)
+                    pipe.publish(REFCODE_FILTER_RESET_CHANNEL, b"")
+                    await pipe.execute()
+                return
+            except RedisError as e:
+                logger.warning("Referral code filter reset failed: %s", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    async def _build_from_db(self, bloom: BloomFilter) -> None:
+        async with self.session_factory() as db:
+            result = await db.stream(
+                select(ReferralCode.code)
+                .execution_options(yield_per=settings.REFERRALS_EXPORT_BATCH_SIZE)
+            )
+            async for partition in result.partitions():
+                for (code,) in partition:
+                    bloom.add(code)
+
+    async def load(self, redis_client: Redis) -> None:
+        """
+        Строит фильтр воркера: из зеркала, если оно есть и совпадает по размеру,
+        иначе из бд с последующим слиянием в зеркало через BITOP OR,
+        чтобы не потерять биты, записанные другими воркерами за это время.
+        """
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        if self.redis_mirror:
+            data = await redis_client.get(REFCODE_FILTER_KEY)
+            if data is not None and len(data) == len(bloom.bits):
+                bloom.load(data)
+                self.bloom = bloom
+                return
+            if data is not None:
+                await redis_client.delete(REFCODE_FILTER_KEY)
+
+        await self._build_from_db(bloom)
+        self.bloom = bloom
+        if self.redis_mirror:
+            tmp_key = f"{REFCODE_FILTER_KEY}:build:{uuid.uuid4().hex}"
+            await redis_client.set(tmp_key, bloom.to_bytes())
+            await redis_client.bitop("OR", REFCODE_FILTER_KEY, REFCODE_FILTER_KEY, tmp_key)
+            await redis_client.delete(tmp_key)
+        logger.info("Referral code filter built from db, codes: %s", bloom.added)
+
+    async def _listen(self, redis_client: Redis) -> None:
+        while True:
+            try:
+                async with redis_client.pubsub() as pubsub:
+                    # Подписка до загрузки: коды, созданные во время загрузки,
+                    # дождутся в канале и будут добавлены следом.
+                    await pubsub.subscribe(REFCODE_FILTER_CHANNEL, REFCODE_FILTER_RESET_CHANNEL)
+                    await self.load(redis_client)
+                    self.ready = True
+                    while True:
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True, timeout=1.0
+                        )
+                        if message is None:
+                            continue
+                        channel = message["channel"]
+                        if isinstance(channel, bytes):
+                            channel = channel.decode()
+                        if channel == REFCODE_FILTER_RESET_CHANNEL:
+                            self.ready = False
+                            await self.load(redis_client)
+                            self.ready = True
+                            continue
+                        code = message["data"]
+                        if isinstance(code, bytes):
+                            code = code.decode()
+                        self.bloom.add(code)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Сообщения за время разрыва потеряны: до перезагрузки фильтр не используется.
+                logger.warning("Referral code filter listener failed: %s", e)
+                self.ready = False
+                await asyncio.sleep(1.0)
+
+    def start(self, redis_client: Redis) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self._listen(redis_client))
+
+    async def stop(self) -> None:
+        if self._reset_task is not None:
+            self._reset_task.cancel()
+            self._reset_task = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.ready = False
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "checks": self.checks,
+            "rejected": self.rejected,
+            **self.bloom.stats(),
+        }
+
+
+referral_code_filter = ReferralCodeFilter(
+    capacity=settings.REFCODE_FILTER_CAPACITY,
+    error_rate=settings.REFCODE_FILTER_ERROR_RATE,
+    redis_mirror=settings.REFCODE_FILTER_REDIS_MIRROR,
+    enabled=settings.REFCODE_FILTER_ENABLED,
+)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from typing import Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.codegen import code_from_sequence
+from app.core.settings import settings
+from app.db.session import AsyncSessionLocal
+from app.models.referral_code import referral_code_seq
+
+
+logger = logging.getLogger(__name__)
+
+# Redis list с заранее сгенерированными кодами.
+REFCODE_POOL_KEY = "refcodes:pool"
+REFCODE_POOL_REFILL_LOCK_KEY = "refcodes:pool:refill"
+
+
+class ReferralCodeGenerator:
+    """
+    Серверная выдача реферальных кодов.
+    Код - prefix + base62 от перестановки значения referral_code_seq
+    (app.core.codegen), поэтому он уникален по построению: ни проверки
+    существования, ни повторов при коллизиях не нужно. Ручные коды
+    с prefix запрещены, так что с ними сгенерированные тоже не пересекаются.
+    Коды выдаются из пула в Redis; когда в пуле остаётся меньше
+    low_watermark кодов, он пополняется в фоне до pool_size.
+    Пустой пул или недоступный Redis - код берётся прямо из последовательности.
+    secret и prefix задаются один раз: после их смены новые коды могут
+    совпасть с уже выданными.
+    """
+
+    def __init__(self, secret: str, prefix: str, pool_size: int, low_watermark: int):
+        if not secret:
+            raise ValueError("Referral code generator secret must not be empty")
+        self.secret = secret
+        self.prefix = prefix
+        self.pool_size = pool_size
+        self.low_watermark = low_watermark
+        self._refill_task: Optional[asyncio.Task] = None
+        self.issued = 0
+        self.pool_misses = 0
+        self.refilled = 0
+
+    def is_reserved(self, code: str) -> bool:
+        """Начинается ли код с префикса сгенерированных кодов."""
+        return code.startswith(self.prefix)
+
+    async def generate(self, db: AsyncSession, count: int) -> list[str]:
+        """count новых кодов за один запрос к последовательности."""
+        result = await db.execute(
+            select(referral_code_seq.next_value()).select_from(func.generate_series(1, count))
+        )
+        return [code_from_sequence(value, self.secret, self.prefix) for value in result.scalars()]
+
+    async def issue(self, db: AsyncSession, redis_client: Optional[Redis] = None) -> str:
+        """Выдаёт один код: из пула, если он не пуст, иначе из последовательности."""
+        code = None
+        if redis_client is not None:
+            try:
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    pipe.lpop(REFCODE_POOL_KEY)
+                    pipe.llen(REFCODE_POOL_KEY)
+                    code, remaining = await pipe.execute()
+            except RedisError as e:
+                logger.warning("Referral code pool is not available: %s", e)
+            else:
+                if remaining < self.low_watermark:
+                    self._schedule_refill(redis_client)
+
+        self.issued += 1
+        if code is not None:
+            return code.decode()
+        self.pool_misses += 1
+        return (await self.generate(db, 1))[0]
+
+    async def refill(self, redis_client: Redis) -> int:
+        """
+        Пополняет пул до pool_size.
+        Одновременно пул пополняет только один воркер (блокировка в Redis).
+        """
+        if not await redis_client.set(REFCODE_POOL_REFILL_LOCK_KEY, b"1", nx=True, ex=30):
+            return 0
+        try:
+            missing = self.pool_size - await redis_client.llen(REFCODE_POOL_KEY)
+            if missing <= 0:
+                return 0
+            async with AsyncSessionLocal() as db:
+                codes = await self.generate(db, missing)
+            await redis_client.rpush(REFCODE_POOL_KEY, *codes)
+        finally:
+            await redis_client.delete(REFCODE_POOL_REFILL_LOCK_KEY)
+        self.refilled += len(codes)
+        return len(codes)
+
+    async def _refill_in_background(self, redis_client: Redis) -> None:
+        try:
+            await self.refill(redis_client)
+        except Exception:
+            logger.exception("Referral code pool refill failed")
+
+    def _schedule_refill(self, redis_client: Redis) -> None:
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill_in_background(redis_client))
+
+    def stats(self) -> dict:
+        return {
+            "issued": self.issued,
+            "pool_misses": self.pool_misses,
+            "refilled": self.refilled,
+        }
+
+
+referral_code_generator = ReferralCodeGenerator(
+    secret=settings.REFCODE_GENERATOR_SECRET,
+    prefix=settings.REFCODE_GENERATED_PREFIX,
+    pool_size=settings.REFCODE_POOL_SIZE,
+    low_watermark=settings.REFCODE_POOL_LOW_WATERMARK,
+)
@@ -1,14 +1,46 @@
-from typing import Optional
+import base64
+import csv
+import io
+import json
+from typing import AsyncIterator, Optional
 from datetime import datetime, timezone
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import exists
-from redis import Redis
+from sqlalchemy.orm import aliased
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from redis.asyncio import Redis
 
+from app.core.settings import settings
+from app.db.session import AsyncSessionLocal, ReadSessionLocal, use_primary
 from app.models.referral_code import ReferralCode
 from app.models.user import User
-from app.schemas.referral_code import ReferralCodeCreate, ReferralCodeResponse, UserRefCodes
+from app.models.loading import REFERRALS_PROFILE, INVITED_USER_PROFILE
+from app.schemas.referral_code import (
+    ReferralCodeBase,
+    ReferralCodeCreate,
+    ReferralCodeResponse,
+    ReferralsResponse,
+    UserRefCodes
+)
+from app.services.caches import (
+    refcodes_cache,
+    referrals_cache,
+    refcode_resolution_cache,
+    referral_code_key,
+    referrer_code_cache,
+    referrer_code_key,
+    user_refcodes_key,
+    user_referrals_key
+)
+from app.services.referral_code_generator import referral_code_generator
+from app.services.referral_code_filter import referral_code_filter
+
+
+# Очередь истечения активных кодов: sorted set id кода -> expires_at (unix time).
+EXPIRY_QUEUE_KEY = "refcodes:expiry"
 
 
 class ReferralCodeService:
@@ -20,112 +52,460 @@ class ReferralCodeService:
         self, referral_code: ReferralCodeCreate,
         current_user_id: int
     ) -> ReferralCode:
-        """Создание нового реферального кода"""
-        new_referral_code = ReferralCode(**referral_code.model_dump(), owner_id=current_user_id)
-        self.db.add(new_referral_code)
-        await self.db.commit()
-        await self.db.refresh(new_referral_code)
+        """
+        Создание нового реферального кода одним INSERT ... ON CONFLICT (code) DO NOTHING RETURNING.
+        Без code выдаётся серверный код, уникальный по построению.
+        Если такой код уже есть, код занят префиксом серверных кодов
+        или у пользователя уже есть активный код, будет ValueError.
+        """
+        values = referral_code.model_dump()
+        if values["code"] is None:
+            values["code"] = await referral_code_generator.issue(self.db, self.redis_client)
+        elif referral_code_generator.is_reserved(values["code"]):
+            raise ValueError(
+                f"Codes starting with '{referral_code_generator.prefix}' are reserved"
+            )
+
+        owner_email = select(User.email).where(User.id == current_user_id).scalar_subquery()
+        try:
+            result = await self.db.execute(
+                pg_insert(ReferralCode)
+                .values(**values, owner_id=current_user_id)
+                .on_conflict_do_nothing(index_elements=[ReferralCode.code])
+                .returning(ReferralCode, owner_email)
+            )
+            row = result.one_or_none()
+            await self.db.commit()
+        except IntegrityError as e:
+            await self.db.rollback()
+            raise ValueError("User has an active referral code already") from e
+
+        if row is None:
+            raise ValueError("Same code exists already")
+
+        new_referral_code, email = row
+        await referral_code_filter.add(new_referral_code.code, self.redis_client)
+        await self.clear_referral_code_resolution_cache(new_referral_code.code)
         await self.clear_user_referral_codes_cache(current_user_id)
+        if new_referral_code.active:
+            await self.clear_referrer_email_cache(email)
+            await self.schedule_expiry(new_referral_code)
         return new_referral_code
 
     async def get_user_referral_codes(self, owner_id: int) -> UserRefCodes:
         """Получение всех реферальных кодов пользователя"""
-        if self.redis_client:
-            cache_key = f"user:{owner_id}:refcodes"
-            cached_data = await self.redis_client.get(cache_key)
-            if cached_data:
-                cashed_refcodes = UserRefCodes.model_validate_json(cached_data)
-                return cashed_refcodes
+        if not self.redis_client:
+            return await self._load_user_referral_codes(owner_id)
+        return UserRefCodes.model_validate_json(await self.get_user_referral_codes_json(owner_id))
+
+    async def get_user_referral_codes_json(self, owner_id: int) -> bytes:
+        """
+        Реферальные коды пользователя в виде готового JSON (UserRefCodes).
+        Чтение идёт через двухуровневый кеш (память воркера + Redis),
+        при промахе запрос в бд выполняется один раз на всех конкурентных клиентов.
+        """
+        if not self.redis_client:
+            content, _ = await self._dump_user_referral_codes(owner_id)
+            return content
+
+        return await refcodes_cache.get_or_compute(
+            self.redis_client,
+            user_refcodes_key(owner_id),
+            loader=lambda: self._dump_user_referral_codes(owner_id),
+            background_loader=lambda: self._dump_user_referral_codes_in_new_session(owner_id),
+        )
 
+    async def _load_user_referral_codes(self, owner_id: int) -> UserRefCodes:
+        """
+        Чтение кодов пользователя из бд без записи.
+        Флаг active поддерживается фоновым ReferralCodeExpiryEngine.
+        """
         result = await self.db.execute(
             select(ReferralCode).where(ReferralCode.owner_id == owner_id)
         )
         referral_codes = result.scalars().all()
 
-        for refcode in referral_codes:
-            if refcode.is_code_expired():
-                refcode.active = False
-                await self.db.commit()
-
         refcodes_pydantic = [
             ReferralCodeResponse.model_validate(refcode) for refcode in referral_codes
         ]
-
-        if self.redis_client:
-            await self.redis_client.setex(
-                cache_key, 600, UserRefCodes(referral_codes=refcodes_pydantic).model_dump_json()
-            )
         return UserRefCodes(referral_codes=refcodes_pydantic)
 
+    async def _dump_user_referral_codes(self, owner_id: int) -> tuple[bytes, int]:
+        """
+        JSON кодов пользователя и время жизни кеша.
+        Кеш не переживает истечение ни одного активного кода, иначе флаг active устареет.
+        """
+        user_refcodes = await self._load_user_referral_codes(owner_id)
+        ttl = settings.REFCODES_CACHE_TTL
+        now = datetime.now(timezone.utc)
+        for refcode in user_refcodes.referral_codes:
+            if refcode.active:
+                ttl = min(ttl, int((refcode.expires_at - now).total_seconds()))
+        return user_refcodes.model_dump_json().encode(), ttl
+
+    @staticmethod
+    async def _dump_user_referral_codes_in_new_session(owner_id: int) -> tuple[bytes, int]:
+        """Фоновое обновление кеша идёт в своей сессии: сессия запроса уже закрыта."""
+        async with AsyncSessionLocal() as db:
+            return await ReferralCodeService(db)._dump_user_referral_codes(owner_id)
+
     async def clear_user_referral_codes_cache(self, owner_id: int) -> None:
         """Функция для очистки кеша."""
         if self.redis_client:
-            cache_key = f"user:{owner_id}:refcodes"
-            await self.redis_client.delete(cache_key)
+            await refcodes_cache.invalidate(self.redis_client, user_refcodes_key(owner_id))
+
+    async def clear_referrer_code_cache(self, owner_id: int) -> None:
+        """Очистка кеша активного кода, который ищется по email реферера."""
+        if self.redis_client:
+            result = await self.db.execute(select(User.email).where(User.id == owner_id))
+            email = result.scalar()
+            if email is not None:
+                await self.clear_referrer_email_cache(email)
+
+    async def clear_referrer_email_cache(self, email: str) -> None:
+        """Очистка кеша активного кода по известному email реферера."""
+        if self.redis_client:
+            await referrer_code_cache.invalidate(self.redis_client, referrer_code_key(email))
 
-    async def get_referral_code_by_code(self, code: str) -> ReferralCode:
-        """Получение данных о реферельном код через сам код"""
+    async def schedule_expiry(self, referral_code: ReferralCode) -> None:
+        """Ставит активный код в очередь истечения."""
+        if self.redis_client and referral_code.active:
+            await self.redis_client.zadd(
+                EXPIRY_QUEUE_KEY, {str(referral_code.id): referral_code.expires_at.timestamp()}
+            )
+
+    async def expire_due_referral_codes(self, batch_size: int) -> int:
+        """
+        Деактивирует все активные коды с наступившим expires_at.
+        Коды обновляются пачками по batch_size одним UPDATE на пачку;
+        SKIP LOCKED позволяет нескольким воркерам работать параллельно.
+        Возвращает количество деактивированных кодов.
+        """
+        total = 0
+        while True:
+            due_codes = (
+                select(ReferralCode.id)
+                .where(ReferralCode.active == True, ReferralCode.expires_at <= func.now())
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            result = await self.db.execute(
+                update(ReferralCode)
+                .where(ReferralCode.id.in_(due_codes), ReferralCode.owner_id == User.id)
+                .values(active=False)
+                .returning(ReferralCode.id, ReferralCode.code, ReferralCode.owner_id, User.email)
+                .execution_options(synchronize_session=False)
+            )
+            expired = result.all()
+            await self.db.commit()
+
+            for code_id, code, owner_id, email in expired:
+                await self.clear_user_referral_codes_cache(owner_id)
+                await self.clear_referrer_email_cache(email)
+                await self.clear_referral_code_resolution_cache(code)
+            if self.redis_client and expired:
+                await self.redis_client.zrem(
+                    EXPIRY_QUEUE_KEY, *[str(code_id) for code_id, _, _, _ in expired]
+                )
+
+            total += len(expired)
+            if len(expired) < batch_size:
+                return total
+
+    async def get_referral_code_by_code(self, code: str) -> Optional[ReferralCodeResponse]:
+        """
+        Получение данных о реферельном код через сам код.
+        Чтение идёт через двухуровневый кеш разрешения кодов, поэтому
+        регистрации по популярному коду не читают referral_codes.
+        Запись живёт не дольше срока действия кода и сбрасывается
+        при создании, активации, истечении и удалении кода.
+        """
+        if not self.redis_client:
+            content, _ = await self._dump_referral_code(code)
+        else:
+            use_primary(self.db)
+            content = await refcode_resolution_cache.get_or_compute(
+                self.redis_client,
+                referral_code_key(code),
+                loader=lambda: self._dump_referral_code(code),
+                background_loader=lambda: self._dump_referral_code_in_new_session(code),
+            )
+        if not content:
+            return None
+        return ReferralCodeResponse.model_validate_json(content)
+
+    async def _dump_referral_code(self, code: str) -> tuple[bytes, int]:
+        """
+        Чтение кода из бд для кеша: (JSON ReferralCodeResponse, ttl).
+        Отсутствие кода кешируется пустым значением на REFERRER_CODE_NEGATIVE_CACHE_TTL.
+        """
         result = await self.db.execute(select(ReferralCode).where(ReferralCode.code == code))
-        referral_code = result.scalars().first()
-        return referral_code
+        referral_code = result.scalar_one_or_none()
+        if referral_code is None:
+            return b"", settings.REFERRER_CODE_NEGATIVE_CACHE_TTL
+
+        ttl = settings.REFCODE_RESOLUTION_CACHE_TTL
+        if referral_code.active:
+            expires_in = (referral_code.expires_at - datetime.now(timezone.utc)).total_seconds()
+            ttl = min(ttl, int(expires_in))
+        return ReferralCodeResponse.model_validate(referral_code).model_dump_json().encode(), ttl
+
+    @staticmethod
+    async def _dump_referral_code_in_new_session(code: str) -> tuple[bytes, int]:
+        async with AsyncSessionLocal() as db:
+            return await ReferralCodeService(db)._dump_referral_code(code)
+
+    async def clear_referral_code_resolution_cache(self, code: str) -> None:
+        if self.redis_client:
+            await refcode_resolution_cache.invalidate(self.redis_client, referral_code_key(code))
 
     async def get_referral_code_by_id(self, code_id: int) -> ReferralCode:
         """Получение данных о реферельном код через его id"""
         referral_code = await self.db.get(ReferralCode, code_id)
         return referral_code
 
-    async def has_user_active_referral_code(self, owner_id: int) -> bool:
-        """Проверка есть ли у пользователя активный код"""
-        result = await self.db.execute(
-            select(exists().where(ReferralCode.owner_id == owner_id, ReferralCode.active == True))
+    async def activate_referral_code(self, code_id: int, owner_id: int) -> ReferralCode:
+        """
+        Активация реферального кода одним условным UPDATE ... RETURNING.
+        Принадлежность, срок действия и отсутствие другого активного кода
+        проверяются в самой бд, гонку параллельных активаций закрывает
+        индекс uq_referral_codes_owner_id_active.
+        Если код не активирован, причина определяется дополнительным запросом:
+            LookupError: кода не существует.
+            PermissionError: код принадлежит другому пользователю.
+            ValueError: код истёк или у пользователя уже есть активный код.
+        """
+        other_code = aliased(ReferralCode)
+        has_other_active_code = (
+            select(other_code.id)
+            .where(
+                other_code.owner_id == owner_id,
+                other_code.active == True,
+                other_code.id != code_id
+            )
+            .exists()
         )
-        return result.scalar()
+        owner_email = select(User.email).where(User.id == owner_id).scalar_subquery()
+        try:
+            result = await self.db.execute(
+                update(ReferralCode)
+                .where(
+                    ReferralCode.id == code_id,
+                    ReferralCode.owner_id == owner_id,
+                    ReferralCode.expires_at > func.now(),
+                    ~has_other_active_code
+                )
+                .values(active=True)
+                .returning(ReferralCode, owner_email)
+                .execution_options(synchronize_session=False, populate_existing=True)
+            )
+            row = result.one_or_none()
+            await self.db.commit()
+        except IntegrityError as e:
+            await self.db.rollback()
+            raise ValueError("User has an active referral code already") from e
 
-    async def activate_referral_code(self, referral_code: ReferralCode) -> ReferralCode:
-        """Активация реферального кода"""
-        referral_code.active = True
-        await self.db.commit()
-        await self.db.refresh(referral_code)
-        await self.clear_user_referral_codes_cache(referral_code.owner_id)
+        if row is None:
+            referral_code = await self.get_referral_code_by_id(code_id)
+            if referral_code is None:
+                raise LookupError("Referral code not found")
+            if referral_code.owner_id != owner_id:
+                raise PermissionError("Access denied: You do not own this referral code")
+            raise ValueError("User has an active referral code already or code is expired")
+
+        referral_code, email = row
+        await self.clear_user_referral_codes_cache(owner_id)
+        await self.clear_referrer_email_cache(email)
+        await self.clear_referral_code_resolution_cache(referral_code.code)
+        await self.schedule_expiry(referral_code)
         return referral_code
 
     async def delete_referral_code(self, referral_code: ReferralCode) -> dict:
-        """Удаление реферльного кода"""
+        """
+        Удаление реферльного кода.
+        Из фильтра Блума код не удаляется: регистрация по нему дойдёт до бд и получит отказ.
+        """
         await self.db.delete(referral_code)
         await self.db.commit()
         await self.clear_user_referral_codes_cache(referral_code.owner_id)
+        await self.clear_referrer_code_cache(referral_code.owner_id)
+        await self.clear_referral_code_resolution_cache(referral_code.code)
+        if self.redis_client:
+            await self.redis_client.zrem(EXPIRY_QUEUE_KEY, str(referral_code.id))
         return {"detail": "Referral code deleted successfully"}
 
-    async def get_referral_code_by_referrer_email(self, email: str) -> Optional[ReferralCode]:
+    async def get_referral_code_by_referrer_email(self, email: str) -> Optional[ReferralCodeBase]:
         """
         Получает активный реферальный код по email реферера.
+        Чтение идёт через двухуровневый кеш, отсутствие кода тоже кешируется.
+        Кеш заполняется с primary, чтобы не закешировать отставание реплики.
+        """
+        if not self.redis_client:
+            content, _ = await self._dump_referrer_code(email)
+        else:
+            use_primary(self.db)
+            content = await referrer_code_cache.get_or_compute(
+                self.redis_client,
+                referrer_code_key(email),
+                loader=lambda: self._dump_referrer_code(email),
+                background_loader=lambda: self._dump_referrer_code_in_new_session(email),
+            )
+        if not content:
+            return None
+        return ReferralCodeBase.model_validate_json(content)
+
+    async def _dump_referrer_code(self, email: str) -> tuple[bytes, int]:
+        """
+        Чтение активного кода реферера из бд для кеша: (JSON ReferralCodeBase, ttl).
+        Отсутствие кода кешируется пустым значением на REFERRER_CODE_NEGATIVE_CACHE_TTL,
+        время жизни найденного кода не превышает срок его действия.
         """
         result = await self.db.execute(
             select(ReferralCode)
             .join(User, ReferralCode.owner_id == User.id)
             .where(User.email == email, ReferralCode.active == True)
         )
-        referral_code = result.scalars().first()
+        referral_code = result.scalar_one_or_none()
         if referral_code is None:
-            return None
+            return b"", settings.REFERRER_CODE_NEGATIVE_CACHE_TTL
 
-        return referral_code
+        expires_in = (referral_code.expires_at - datetime.now(timezone.utc)).total_seconds()
+        ttl = min(settings.REFERRER_CODE_CACHE_TTL, int(expires_in))
+        return ReferralCodeBase.model_validate(referral_code).model_dump_json().encode(), ttl
+
+    @staticmethod
+    async def _dump_referrer_code_in_new_session(email: str) -> tuple[bytes, int]:
+        async with AsyncSessionLocal() as db:
+            return await ReferralCodeService(db)._dump_referrer_code(email)
 
-    async def get_invited_users_by_referrer_id(self, referrer_id: int) -> dict:
+    async def get_invited_users_by_referrer_id(
+        self, referrer_id: int,
+        limit: int = settings.REFERRALS_PAGE_SIZE,
+        after_id: Optional[int] = None
+    ) -> ReferralsResponse:
         """
-        Получает всех рефералов через id реферера.
+        Получает страницу рефералов через id реферера.
         """
-        user = await self.db.get(User, referrer_id)
+        return ReferralsResponse.model_validate_json(
+            await self.get_invited_users_by_referrer_id_json(referrer_id, limit, after_id)
+        )
+
+    async def get_invited_users_by_referrer_id_json(
+        self, referrer_id: int,
+        limit: int = settings.REFERRALS_PAGE_SIZE,
+        after_id: Optional[int] = None
+    ) -> bytes:
+        """
+        Страница рефералов в виде готового JSON (ReferralsResponse).
+        Рефералы упорядочены по id, следующая страница - после after_id (keyset).
+        Первая страница размера по умолчанию читается через двухуровневый кеш
+        и заполняет его с primary, остальные страницы можно читать с реплики.
+        """
+        if not self.redis_client or after_id is not None or limit != settings.REFERRALS_PAGE_SIZE:
+            return await self._dump_invited_users(referrer_id, limit, after_id)
+
+        use_primary(self.db)
+        return await referrals_cache.get_or_compute(
+            self.redis_client,
+            user_referrals_key(referrer_id),
+            loader=lambda: self._dump_invited_users(referrer_id, limit),
+            background_loader=lambda: self._dump_invited_users_in_new_session(referrer_id, limit),
+        )
+
+    async def _load_invited_users(
+        self, referrer_id: int, limit: int, after_id: Optional[int] = None
+    ) -> ReferralsResponse:
+        """
+        Чтение реферера и страницы его рефералов из бд.
+        Общее количество берётся из счётчика users.invited_count, без COUNT(*).
+        """
+        result = await self.db.execute(
+            select(User).where(User.id == referrer_id).options(*REFERRALS_PROFILE)
+        )
+        user = result.scalar_one_or_none()
         if user is None:
             raise ValueError("User not found")
 
-        result = await self.db.execute(
+        query = (
             select(User)
             .where(User.invited_by_id == referrer_id)
+            .order_by(User.id)
+            .limit(limit + 1)
+            .options(*INVITED_USER_PROFILE)
         )
+        if after_id is not None:
+            query = query.where(User.id > after_id)
+        result = await self.db.execute(query)
         invited_users = result.scalars().all()
 
-        return {
+        next_cursor = None
+        if len(invited_users) > limit:
+            invited_users = invited_users[:limit]
+            next_cursor = encode_cursor(invited_users[-1].id)
+
+        return ReferralsResponse.model_validate({
             "user": user,
-            "invited_users": invited_users
-        }
+            "invited_users": invited_users,
+            "total": user.invited_count,
+            "next_cursor": next_cursor
+        })
+
+    async def _dump_invited_users(
+        self, referrer_id: int, limit: int, after_id: Optional[int] = None
+    ) -> bytes:
+        referrals = await self._load_invited_users(referrer_id, limit, after_id)
+        return referrals.model_dump_json().encode()
+
+    @staticmethod
+    async def _dump_invited_users_in_new_session(referrer_id: int, limit: int) -> bytes:
+        async with AsyncSessionLocal() as db:
+            return await ReferralCodeService(db)._dump_invited_users(referrer_id, limit)
+
+    @staticmethod
+    async def export_invited_users(referrer_id: int, export_format: str) -> AsyncIterator[bytes]:
+        """
+        Построчная выгрузка всех рефералов в NDJSON или CSV.
+        Строки читаются серверным курсором пачками по REFERRALS_EXPORT_BATCH_SIZE,
+        поэтому память не зависит от количества рефералов.
+        Генератор работает в своей сессии: StreamingResponse отдаётся
+        уже после закрытия сессии запроса. Выгрузка читается с реплики.
+        """
+        async with ReadSessionLocal() as db:
+            result = await db.stream(
+                select(User.id, User.email, User.invited_by_id)
+                .where(User.invited_by_id == referrer_id)
+                .order_by(User.id)
+                .execution_options(yield_per=settings.REFERRALS_EXPORT_BATCH_SIZE)
+            )
+            if export_format == "csv":
+                yield b"id,email,invited_by_id\r\n"
+            async for partition in result.partitions():
+                buffer = io.StringIO()
+                if export_format == "csv":
+                    csv.writer(buffer).writerows(partition)
+                else:
+                    for user_id, email, invited_by_id in partition:
+                        buffer.write(json.dumps(
+                            {"id": user_id, "email": email, "invited_by_id": invited_by_id},
+                            separators=(",", ":")
+                        ))
+                        buffer.write("\n")
+                yield buffer.getvalue().encode()
+
+
+def encode_cursor(last_id: int) -> str:
+    """Непрозрачный курсор страницы рефералов."""
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Разбирает курсор, при некорректном значении будет ValueError."""
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        prefix, last_id = decoded.split(":", 1)
+        if prefix != "id":
+            raise ValueError
+        return int(last_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
@@ -0,0 +1,136 @@
+from typing import Optional, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, insert, literal, union_all
+from sqlalchemy.future import select
+
+from app.models.user import User
+from app.models.referral_tree import ReferralTree
+from app.schemas.referral_tree import (
+    ReferralTreeNode,
+    ReferralTreeResponse,
+    AncestorsResponse,
+    SubtreeSizeResponse,
+)
+
+
+class ReferralTreeService:
+    """
+    Запросы к многоуровневому дереву приглашений.
+    Дерево хранится в таблице замыкания referral_tree, поэтому потомки,
+    цепочка предков и размер поддерева читаются одним запросом по индексу,
+    без рекурсии ни в Python, ни в базе.
+    """
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def add_user(self, user_id: int, invited_by_id: Optional[int] = None) -> None:
+        """
+        Добавляет пользователя в дерево: строку на себя и по строке на каждого
+        предка пригласившего (depth + 1). Коммит остаётся за вызывающим,
+        чтобы пользователь и его строки дерева попали в одну транзакцию.
+        """
+        rows = select(literal(user_id), literal(user_id), literal(0))
+        if invited_by_id is not None:
+            rows = union_all(
+                rows,
+                select(ReferralTree.ancestor_id, literal(user_id), ReferralTree.depth + 1)
+                .where(ReferralTree.descendant_id == invited_by_id),
+            )
+        await self.db.execute(
+            insert(ReferralTree).from_select(["ancestor_id", "descendant_id", "depth"], rows)
+        )
+
+    async def add_users(self, user_ids: Sequence[int]) -> None:
+        """
+        Массовый вариант add_user одним INSERT ... SELECT: пригласивший берётся
+        из users.invited_by_id. Пригласившие должны уже быть в дереве.
+        """
+        if not user_ids:
+            return
+        rows = union_all(
+            select(User.id, User.id, literal(0)).where(User.id.in_(user_ids)),
+            select(ReferralTree.ancestor_id, User.id, ReferralTree.depth + 1)
+            .join(User, User.invited_by_id == ReferralTree.descendant_id)
+            .where(User.id.in_(user_ids)),
+        )
+        await self.db.execute(
+            insert(ReferralTree).from_select(["ancestor_id", "descendant_id", "depth"], rows)
+        )
+
+    async def get_descendants(
+        self,
+        user_id: int,
+        max_depth: int,
+        limit: int,
+    ) -> ReferralTreeResponse:
+        """
+        Потомки пользователя до глубины max_depth включительно,
+        упорядоченные по глубине, затем по id.
+        Строка пользователя на себя (depth = 0) читается тем же запросом
+        и служит проверкой существования: её нет - будет ValueError.
+        Выдача ограничена limit; если потомков больше, truncated = True.
+        """
+        result = await self.db.execute(
+            select(User.id, User.email, User.invited_by_id, ReferralTree.depth)
+            .join(ReferralTree, ReferralTree.descendant_id == User.id)
+            .where(ReferralTree.ancestor_id == user_id, ReferralTree.depth <= max_depth)
+            .order_by(ReferralTree.depth, ReferralTree.descendant_id)
+            .limit(limit + 2)
+        )
+        rows = result.all()
+        if not rows:
+            raise ValueError("User not found")
+
+        descendants = [ReferralTreeNode.model_validate(row) for row in rows[1:]]
+        return ReferralTreeResponse(
+            user_id=user_id,
+            descendants=descendants[:limit],
+            truncated=len(descendants) > limit,
+        )
+
+    async def get_ancestors(self, user_id: int) -> AncestorsResponse:
+        """
+        Цепочка пригласивших от прямого реферера до корня дерева.
+        Если пользователя нет, будет ValueError.
+        """
+        result = await self.db.execute(
+            select(User.id, User.email, User.invited_by_id, ReferralTree.depth)
+            .join(ReferralTree, ReferralTree.ancestor_id == User.id)
+            .where(ReferralTree.descendant_id == user_id)
+            .order_by(ReferralTree.depth)
+        )
+        rows = result.all()
+        if not rows:
+            raise ValueError("User not found")
+
+        return AncestorsResponse(
+            user_id=user_id,
+            ancestors=[ReferralTreeNode.model_validate(row) for row in rows[1:]],
+        )
+
+    async def get_subtree_size(
+        self,
+        user_id: int,
+        max_depth: Optional[int] = None,
+    ) -> SubtreeSizeResponse:
+        """
+        Количество потомков пользователя (без него самого),
+        при заданном max_depth - только до этой глубины.
+        Считается по индексу (ancestor_id, depth) без чтения users.
+        Если пользователя нет, будет ValueError.
+        """
+        query = (
+            select(func.count())
+            .select_from(ReferralTree)
+            .where(ReferralTree.ancestor_id == user_id)
+        )
+        if max_depth is not None:
+            query = query.where(ReferralTree.depth <= max_depth)
+        count = await self.db.scalar(query)
+        if not count:
+            raise ValueError("User not found")
+
+        return SubtreeSizeResponse(
+            user_id=user_id, subtree_size=count - 1, max_depth=max_depth
+        )
@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import csv
+import json
+from collections import Counter
+from typing import AsyncIterator, Optional
+
+from pydantic import ValidationError
+from redis.asyncio import Redis
+from sqlalchemy import Column, Integer, MetaData, String, Table, bindparam, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.schema import CreateTable
+
+from app.core.hashing import bulk_password_hasher
+from app.core.settings import settings
+from app.db.session import AsyncSessionLocal
+from app.models.user import User
+from app.models.referral_code import ReferralCode
+from app.schemas.user_import import UserImportRow, UserImportError, UserImportReport
+from app.services.caches import referrals_cache, user_referrals_key
+from app.services.leaderboard_service import LeaderboardService
+from app.services.referral_tree_service import ReferralTreeService
+
+
+# Временная таблица на одну пачку: заполняется через COPY и удаляется при коммите.
+users_import = Table(
+    "users_import",
+    MetaData(),
+    Column("line", Integer, nullable=False),
+    Column("email", String, nullable=False),
+    Column("hashed_password", String, nullable=False),
+    Column("invited_by_id", Integer),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(
+        ".".join(str(loc) for loc in error["loc"]) + ": " + error["msg"] if error["loc"]
+        else error["msg"]
+        for error in e.errors()
+    )
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Режет поток байтов (тело запроса, файл) на строки.
+    Строки декодируются при разборе, чтобы ошибка кодировки попала в отчёт.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if buffer:
+        yield buffer.rstrip(b"\r")
+
+
+class UserImportService:
+    """
+    Массовый импорт пользователей из NDJSON или CSV.
+    Строки обрабатываются пачками по batch_size: реферальные коды разрешаются
+    в invited_by_id одним запросом, пароли хешируются в пуле процессов вне
+    транзакции, затем в одной транзакции коды перепроверяются, строки
+    загружаются через COPY во временную таблицу и сливаются в users одним
+    INSERT ... ON CONFLICT (email) DO NOTHING.
+    В той же транзакции обновляются дерево приглашений и счётчики invited_count.
+    Ошибки возвращаются построчно, некорректные строки не прерывают импорт.
+    CSV читается построчно: переводы строк внутри значений не поддерживаются.
+    """
+
+    def __init__(
+        self,
+        db: AsyncSession,
+        redis_client: Optional[Redis] = None,
+        batch_size: int = settings.USER_IMPORT_BATCH_SIZE,
+        max_reported_errors: int = settings.USER_IMPORT_MAX_REPORTED_ERRORS,
+    ):
+        self.db = db
+        self.redis_client = redis_client
+        self.batch_size = batch_size
+        self.max_reported_errors = max_reported_errors
+        self.report = UserImportReport()
+        self._seen_emails: set[str] = set()
+
+    def _fail(self, line: int, email: Optional[str], error: str) -> None:
+        self.report.failed += 1
+        if len(self.report.errors) < self.max_reported_errors:
+            self.report.errors.append(UserImportError(line=line, email=email, error=error))
+
+    async def import_lines(
+        self, lines: AsyncIterator[bytes], import_format: str
+    ) -> UserImportReport:
+        """
+        Импортирует строки NDJSON или CSV (с заголовком) в UTF-8.
+        Номера строк в отчёте считаются с 1, включая заголовок CSV.
+        """
+        header: Optional[list[str]] = None
+        batch: list[tuple[int, UserImportRow]] = []
+        line_number = 0
+        async for line in lines:
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                text = line.decode()
+                if import_format == "csv":
+                    values = next(csv.reader([text]))
+                    if header is None:
+                        header = values
+                        continue
+                    data = {key: value or None for key, value in zip(header, values)}
+                else:
+                    data = json.loads(text)
+                row = UserImportRow.model_validate(data)
+            except (ValueError, ValidationError) as e:
+                message = _validation_message(e) if isinstance(e, ValidationError) else str(e)
+                self._fail(line_number, None, message)
+                continue
+
+            if row.email in self._seen_emails:
+                self._fail(line_number, row.email, "Duplicate email in file")
+                continue
+            self._seen_emails.add(row.email)
+
+            batch.append((line_number, row))
+            if len(batch) >= self.batch_size:
+                await self._import_batch(batch)
+                batch = []
+
+        if batch:
+            await self._import_batch(batch)
+        self.report.errors.sort(key=lambda error: error.line)
+        return self.report
+
+    async def _resolve_referral_codes(self, codes: set[str]) -> dict[str, int]:
+        """Владельцы активных кодов пачки одним запросом: {код: owner_id}."""
+        if not codes:
+            return {}
+        result = await self.db.execute(
+            select(ReferralCode.code, ReferralCode.owner_id)
+            .where(ReferralCode.code.in_(codes), ReferralCode.active == True)
+        )
+        return dict(result.all())
+
+    async def _copy_and_merge(self, records: list[tuple]) -> list[tuple[int, str, Optional[int]]]:
+        """
+        Загружает пачку во временную таблицу через COPY и сливает её в users.
+        Возвращает вставленные строки (id, email, invited_by_id);
+        занятые email пропускаются.
+        """
+        await self.db.execute(CreateTable(users_import))
+        connection = await self.db.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            users_import.name,
+            records=records,
+            columns=[c.name for c in users_import.columns],
+        )
+        result = await self.db.execute(
+            pg_insert(User)
+            .from_select(
+                ["email", "hashed_password", "invited_by_id"],
+                select(
+                    users_import.c.email,
+                    users_import.c.hashed_password,
+                    users_import.c.invited_by_id,
+                ).order_by(users_import.c.line),
+            )
+            .on_conflict_do_nothing(index_elements=["email"])
+            .returning(User.id, User.email, User.invited_by_id)
+        )
+        return result.all()
+
+    async def _import_batch(self, batch: list[tuple[int, UserImportRow]]) -> None:
+        owners = await self._resolve_referral_codes(
+            {row.referral_code for _, row in batch if row.referral_code}
+        )
+        # Чтение открыло транзакцию: закрываем её, чтобы соединение
+        # не простаивало в транзакции, пока пароли хешируются.
+        await self.db.rollback()
+        accepted = []
+        for line, row in batch:
+            if row.referral_code and row.referral_code not in owners:
+                self._fail(line, row.email, "Invalid or inactive referral code.")
+            else:
+                accepted.append((line, row))
+        if not accepted:
+            return
+
+        hashes = iter(await bulk_password_hasher.hash_many(
+            [row.password for _, row in accepted if row.hashed_password is None]
+        ))
+        hashed = [
+            (line, row, row.hashed_password if row.hashed_password is not None else next(hashes))
+            for line, row in accepted
+        ]
+
+        # Коды перепроверяются в транзакции записи: за время хеширования их могли отключить.
+        owners = await self._resolve_referral_codes(
+            {row.referral_code for _, row in accepted if row.referral_code}
+        )
+        accepted = []
+        records = []
+        for line, row, hashed_password in hashed:
+            if row.referral_code and row.referral_code not in owners:
+                self._fail(line, row.email, "Invalid or inactive referral code.")
+                continue
+            accepted.append((line, row))
+            records.append((line, row.email, hashed_password, owners.get(row.referral_code)))
+        if not records:
+            await self.db.rollback()
+            return
+
+        inserted = await self._copy_and_merge(records)
+        await ReferralTreeService(self.db).add_users([user_id for user_id, _, _ in inserted])
+        referrals = Counter(
+            invited_by_id for _, _, invited_by_id in inserted if invited_by_id is not None
+        )
+        invited_counts = {}
+        if referrals:
+            # Счётчики обновляются в порядке id, чтобы не ловить взаимоблокировки
+            # с параллельными регистрациями.
+            await self.db.execute(
+                update(User.__table__)
+                .where(User.__table__.c.id == bindparam("referrer_id"))
+                .values(invited_count=User.__table__.c.invited_count + bindparam("invited")),
+                [
+                    {"referrer_id": referrer_id, "invited": referrals[referrer_id]}
+                    for referrer_id in sorted(referrals)
+                ],
+            )
+            # Строки заблокированы UPDATE до коммита, так что это значения, которые закоммитим.
+            result = await self.db.execute(
+                select(User.id, User.invited_count).where(User.id.in_(referrals))
+            )
+            invited_counts = dict(result.all())
+        await self.db.commit()
+
+        inserted_emails = {email for _, email, _ in inserted}
+        for line, row in accepted:
+            if row.email not in inserted_emails:
+                self._fail(line, row.email, "Email already registered")
+        self.report.imported += len(inserted)
+
+        await LeaderboardService(self.db, self.redis_client).record_referrals(invited_counts)
+        if self.redis_client:
+            for referrer_id in referrals:
+                await referrals_cache.invalidate(self.redis_client, user_referrals_key(referrer_id))
+
+
+async def _iter_file(path: str) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            yield chunk
+
+
+async def main() -> None:
+    """Импорт из файла: python -m app.services.user_import_service users.csv --format csv"""
+    from app.core.redis import init_redis, close_redis
+
+    parser = argparse.ArgumentParser(description="Bulk user import")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    args = parser.parse_args()
+
+    redis_client = await init_redis()
+    try:
+        async with AsyncSessionLocal() as db:
+            service = UserImportService(db, redis_client)
+            report = await service.import_lines(iter_lines(_iter_file(args.path)), args.format)
+        print(report.model_dump_json(indent=2))
+    finally:
+        await close_redis()
+        bulk_password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,64 +1,135 @@
-from typing import Optional
+from typing import Optional, Sequence
+from datetime import datetime, timezone
 
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, insert, literal, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.interfaces import ORMOption
+from redis.asyncio import Redis
 from app.models.user import User
 from app.models.referral_code import ReferralCode
 from app.schemas.user import UserCreate, UserCreateByRefCode
-from app.core.security import hash_password
+from app.core.hashing import password_hasher
+from app.services.caches import referrals_cache, user_referrals_key
+from app.services.referral_tree_service import ReferralTreeService
+from app.services.leaderboard_service import LeaderboardService
+from app.services.referral_code_filter import referral_code_filter
+from app.services.referral_code_service import ReferralCodeService
 
 
 class UserService:
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, redis_client: Optional[Redis] = None):
         self.db = db
+        self.redis_client = redis_client
 
     async def create_user(self, user: UserCreate) -> User:
         """
         Создает нового пользователя в базе данных.
         Пароль хешируется перед сохранением.
+        Пользователь становится корнем своего дерева приглашений.
         """
-        hashed_password = hash_password(user.password)
+        hashed_password = await password_hasher.hash(user.password)
         new_user = User(email=user.email, hashed_password=hashed_password)
         self.db.add(new_user)
+        await self.db.flush()
+        await ReferralTreeService(self.db).add_user(new_user.id)
         await self.db.commit()
         await self.db.refresh(new_user)
         return new_user
 
-    async def get_user_by_email(self, email: str) -> User:
+    async def get_user_by_email(self, email: str, profile: Sequence[ORMOption] = ()) -> User:
         """
         Получает пользователя из бд через его email.
+        profile - профиль загрузки из app.models.loading.
         """
-        result = await self.db.execute(select(User).where(User.email == email))
+        result = await self.db.execute(select(User).where(User.email == email).options(*profile))
         return result.scalars().first()
 
-    async def get_user_by_id(self, user_id: int) -> User:
+    async def get_user_by_id(self, user_id: int, profile: Sequence[ORMOption] = ()) -> User:
         """
         Получает пользователя из бд через его id.
+        profile - профиль загрузки из app.models.loading.
         """
-        result = await self.db.execute(select(User).where(User.id == user_id))
+        result = await self.db.execute(select(User).where(User.id == user_id).options(*profile))
         return result.scalars().first()
 
     async def create_user_by_refcode(self, user: UserCreateByRefCode) -> Optional[User]:
         """
         Создает нового пользователя в базе данных с реферальным кодом.
         Пароль хешируется перед сохранением.
+        Код разрешается в owner_id через кеш разрешения кодов, так что
+        регистрация по популярному коду - один INSERT без отдельного чтения
+        referral_codes. Активность кода INSERT перепроверяет по первичному ключу:
+        устаревшая запись кеша не даст зарегистрироваться по отключённому коду.
+        В той же транзакции увеличивается счётчик invited_count реферера
+        и пользователь добавляется в дерево приглашений под реферером.
+        Возвращает None, если кода нет, он неактивен или истёк.
+        Заведомо несуществующий код отсекается фильтром Блума до bcrypt и бд.
+        Если email уже занят, будет ValueError.
         """
-        result = await self.db.execute(
-            select(ReferralCode)
-            .where(ReferralCode.code == user.referral_code, ReferralCode.active == True)
-            .options(
-                selectinload(ReferralCode.owner).selectinload(User.invited_users)
-            )
-        )
-        referral_code = result.scalars().first()
+        if not await referral_code_filter.might_exist(user.referral_code, self.redis_client):
+            return None
 
-        if not referral_code:
+        referral_code_service = ReferralCodeService(self.db, self.redis_client)
+        referral_code = await referral_code_service.get_referral_code_by_code(user.referral_code)
+        if (
+            referral_code is None
+            or not referral_code.active
+            or referral_code.expires_at <= datetime.now(timezone.utc)
+        ):
             return None
 
-        new_user = await self.create_user(user)
-        new_user.invited_by_id = referral_code.owner_id
-        referral_code.owner.invited_users.append(new_user)
-        await self.db.commit()
-        await self.db.refresh(new_user)
+        hashed_password = await password_hasher.hash(user.password)
+        code_is_active = (
+            select(ReferralCode.id)
+            .where(
+                ReferralCode.id == referral_code.id,
+                ReferralCode.owner_id == referral_code.owner_id,
+                ReferralCode.active == True,
+                ReferralCode.expires_at > func.now()
+            )
+            .exists()
+        )
+        try:
+            result = await self.db.execute(
+                insert(User)
+                .from_select(
+                    ["email", "hashed_password", "invited_by_id"],
+                    select(
+                        literal(user.email),
+                        literal(hashed_password),
+                        literal(referral_code.owner_id)
+                    ).where(code_is_active),
+                )
+                .returning(User)
+            )
+            new_user = result.scalar_one_or_none()
+            if new_user is None:
+                await self.db.rollback()
+                await referral_code_service.clear_referral_code_resolution_cache(
+                    user.referral_code
+                )
+                return None
+            result = await self.db.execute(
+                update(User)
+                .where(User.id == new_user.invited_by_id)
+                .values(invited_count=User.invited_count + 1)
+                .returning(User.invited_count)
+                .execution_options(synchronize_session=False)
+            )
+            invited_count = result.scalar_one()
+            await ReferralTreeService(self.db).add_user(new_user.id, new_user.invited_by_id)
+            await self.db.commit()
+        except IntegrityError as e:
+            await self.db.rollback()
+            raise ValueError("Email already registered") from e
+
+        await LeaderboardService(self.db, self.redis_client).record_referral(
+            new_user.invited_by_id, invited_count
+        )
+        if self.redis_client:
+            await referrals_cache.invalidate(
+                self.redis_client, user_referrals_key(new_user.invited_by_id)
+            )
         return new_user
@@ -0,0 +1,58 @@
+"""
+Сравнение стоимости ответа на попадание в кеш /refcodes.
+
+old: JSON из Redis -> UserRefCodes.model_validate_json -> повторная валидация
+     по response_model -> сериализация в JSON (как это делает FastAPI).
+new: байты из Redis отдаются в Response как есть.
+
+Запуск: python -m benchmarks.cached_response
+"""
+import json
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+from app.schemas.referral_code import ReferralCodeResponse, UserRefCodes
+
+
+def build_payload(codes: int) -> bytes:
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    refcodes = UserRefCodes(referral_codes=[
+        ReferralCodeResponse(
+            id=i, owner_id=1, code=f"code-{i}", expires_at=expires_at, active=i == 0
+        )
+        for i in range(codes)
+    ])
+    return refcodes.model_dump_json().encode()
+
+
+response_adapter = TypeAdapter(UserRefCodes)
+
+
+def old_path(cached: bytes) -> bytes:
+    refcodes = UserRefCodes.model_validate_json(cached)
+    validated = response_adapter.validate_python(refcodes, from_attributes=True)
+    content = response_adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def new_path(cached: bytes) -> bytes:
+    return Response(content=cached, media_type="application/json").body
+
+
+def main() -> None:
+    for codes in (1, 10, 100):
+        cached = build_payload(codes)
+        number = 20000 if codes < 100 else 2000
+        old = min(timeit.repeat(lambda: old_path(cached), number=number, repeat=5)) / number
+        new = min(timeit.repeat(lambda: new_path(cached), number=number, repeat=5)) / number
+        print(
+            f"{codes:>4} codes: old {old * 1e6:8.1f} us, new {new * 1e6:6.1f} us, "
+            f"x{old / new:.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from app.core.cache import RecomputingCache
+
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_get_or_compute_stores_value(redis_client):
+    cache = RecomputingCache(ttl=60)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        return b"value"
+
+    assert await cache.get_or_compute(redis_client, "key", loader) == b"value"
+    assert await cache.get_or_compute(redis_client, "key", loader) == b"value"
+    assert calls == 1
+
+
+async def test_invalidate_during_fill_is_not_overwritten(redis_client):
+    cache = RecomputingCache(ttl=60)
+
+    async def stale_loader():
+        await cache.invalidate(redis_client, "key")
+        return b"stale"
+
+    async def fresh_loader():
+        return b"fresh"
+
+    assert await cache.get_or_compute(redis_client, "key", stale_loader) == b"stale"
+    assert not await redis_client.exists("key")
+    assert await cache.get_or_compute(redis_client, "key", fresh_loader) == b"fresh"
+    assert await cache.get_or_compute(redis_client, "key", stale_loader) == b"fresh"
+
+
+async def test_coalesced_fill_does_not_use_request_loader(redis_client):
+    cache = RecomputingCache(ttl=60)
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def request_loader():
+        started.set()
+        raise RuntimeError("request session is closed")
+
+    async def background_loader():
+        started.set()
+        await release.wait()
+        return b"value"
+
+    first = asyncio.create_task(
+        cache.get_or_compute(redis_client, "key", request_loader, background_loader)
+    )
+    await started.wait()
+    second = asyncio.create_task(
+        cache.get_or_compute(redis_client, "key", request_loader, background_loader)
+    )
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+
+    assert await second == b"value"
+    assert cache.stats()["coalesced"] == 1
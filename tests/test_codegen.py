@@ -0,0 +1,76 @@
+import random
+
+import pytest
+from pydantic import ValidationError
+
+from app.core.codegen import (
+    CODE_WIDTH,
+    DOMAIN_SIZE,
+    base62_decode,
+    base62_encode,
+    code_from_sequence,
+    permute,
+    sequence_from_code,
+    unpermute,
+)
+from app.core.settings import Settings
+
+
+SECRET = "test-secret"
+SAMPLE = [0, 1, 2, 61, 62, DOMAIN_SIZE // 2, DOMAIN_SIZE - 2, DOMAIN_SIZE - 1] + [
+    random.Random(0).randrange(DOMAIN_SIZE) for _ in range(1000)
+]
+
+
+@pytest.mark.parametrize("value", SAMPLE[:8])
+def test_base62_round_trip_bounds(value):
+    code = base62_encode(value)
+    assert len(code) == CODE_WIDTH
+    assert base62_decode(code) == value
+
+
+def test_base62_round_trip():
+    for value in SAMPLE:
+        assert base62_decode(base62_encode(value)) == value
+
+
+def test_permute_round_trip():
+    for value in SAMPLE:
+        permuted = permute(value, SECRET)
+        assert 0 <= permuted < DOMAIN_SIZE
+        assert unpermute(permuted, SECRET) == value
+
+
+def test_permute_is_a_bijection_on_sample():
+    assert len({permute(value, SECRET) for value in range(10000)}) == 10000
+
+
+def test_permute_depends_on_secret():
+    assert [permute(value, SECRET) for value in range(10)] != [
+        permute(value, "other-secret") for value in range(10)
+    ]
+
+
+@pytest.mark.parametrize("value", [-1, DOMAIN_SIZE])
+def test_permute_rejects_values_outside_domain(value):
+    with pytest.raises(OverflowError):
+        permute(value, SECRET)
+
+
+def test_code_round_trip():
+    for value in SAMPLE:
+        code = code_from_sequence(value, SECRET, "_")
+        assert code.startswith("_")
+        assert len(code) == 1 + CODE_WIDTH
+        assert sequence_from_code(code, SECRET, "_") == value
+
+
+@pytest.mark.parametrize("code", ["abcdefg", "_abc", "_abcdefgh"])
+def test_sequence_from_code_rejects_manual_codes(code):
+    with pytest.raises(ValueError):
+        sequence_from_code(code, SECRET, "_")
+
+
+def test_settings_reject_empty_generated_prefix():
+    with pytest.raises(ValidationError):
+        Settings(REFCODE_GENERATED_PREFIX="")
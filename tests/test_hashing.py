@@ -0,0 +1,21 @@
+import asyncio
+
+import pytest
+
+from app.core.hashing import PasswordHasher
+from app.core.security import validate_password
+
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_hash_many_waits_for_pool():
+    hasher = PasswordHasher(executor_type="thread", max_workers=2, max_queue=2)
+    try:
+        results = await asyncio.gather(*(hasher.hash_many(["a", "b", "c"]) for _ in range(3)))
+    finally:
+        hasher.shutdown()
+
+    assert [len(hashes) for hashes in results] == [3, 3, 3]
+    assert validate_password("c", results[0][2])
+    assert hasher.stats()["rejected"] == 0
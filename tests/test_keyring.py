@@ -0,0 +1,60 @@
+import pytest
+
+from app.core.keyring import JWTKeyring
+from app.core.security import decode_jwt, encode_jwt
+from app.core.settings import Settings
+
+
+def _keyring(keys_dir) -> JWTKeyring:
+    return JWTKeyring(
+        signing_kid="primary",
+        private_key_path=keys_dir / "private.pem",
+        public_key_path=keys_dir / "public.pem",
+        algorithm="RS256",
+    )
+
+
+def test_reload_picks_up_new_signing_key(make_keys):
+    old_keys, new_keys = make_keys(), make_keys()
+    keyring = _keyring(old_keys)
+
+    keyring.reload(lambda: Settings(
+        JWT_KID="next",
+        PRIVATE_KEY_PATH=new_keys / "private.pem",
+        PUBLIC_KEY_PATH=new_keys / "public.pem",
+        JWT_VERIFY_KEYS={"primary": old_keys / "public.pem"},
+    ))
+
+    kid, _, algorithm = keyring.signing_key()
+    assert (kid, algorithm) == ("next", "RS256")
+    assert keyring.verification_key("next") is not None
+    assert keyring.verification_key("primary") is not None
+    assert keyring.verification_key(None) == keyring.verification_key("next")
+
+
+def test_failed_reload_keeps_previous_keys(make_keys, tmp_path):
+    keyring = _keyring(make_keys())
+    previous = keyring.signing_key()
+
+    keyring.reload(lambda: Settings(
+        JWT_KID="next",
+        PRIVATE_KEY_PATH=tmp_path / "missing.pem",
+        PUBLIC_KEY_PATH=tmp_path / "missing.pub.pem",
+    ))
+
+    assert keyring.signing_key() == previous
+    assert keyring.verification_key("next") is None
+
+
+def test_decode_rejects_unknown_kid(make_keys):
+    retired_keys = make_keys()
+    signer = JWTKeyring(
+        signing_kid="retired",
+        private_key_path=retired_keys / "private.pem",
+        public_key_path=retired_keys / "public.pem",
+        algorithm="RS256",
+    )
+    token = encode_jwt({"sub": "user@example.com"}, jwt_keyring=signer)
+
+    with pytest.raises(ValueError):
+        decode_jwt(token, jwt_keyring=_keyring(make_keys()))
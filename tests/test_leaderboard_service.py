@@ -0,0 +1,62 @@
+import pytest
+
+from app.models.user import User
+from app.services.leaderboard_service import (
+    LEADERBOARD_BUILT_KEY,
+    LEADERBOARD_KEY,
+    LEADERBOARD_REBUILD_LOCK_KEY,
+    LeaderboardService,
+)
+
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_rebuild_and_get_top(db, redis_client):
+    db.add_all([
+        User(email="a@example.com", hashed_password="x", invited_count=2),
+        User(email="b@example.com", hashed_password="x", invited_count=5),
+        User(email="c@example.com", hashed_password="x", invited_count=0),
+    ])
+    await db.commit()
+    service = LeaderboardService(db, redis_client)
+
+    assert await service.rebuild(batch_size=1) == 2
+    top = await service.get_top(10)
+    assert [(entry.email, entry.invited_count) for entry in top.referrers] == [
+        ("b@example.com", 5), ("a@example.com", 2)
+    ]
+
+
+async def test_empty_rebuild_is_not_repeated_on_startup(db, redis_client, monkeypatch):
+    service = LeaderboardService(db, redis_client)
+    await service.rebuild_if_missing()
+    assert not await redis_client.exists(LEADERBOARD_KEY)
+
+    async def rebuild(*args, **kwargs):
+        raise AssertionError("leaderboard rebuilt again")
+    monkeypatch.setattr(service, "rebuild", rebuild)
+    await service.rebuild_if_missing()
+
+
+async def test_record_referral_resyncs_stale_score(db, redis_client):
+    service = LeaderboardService(db, redis_client)
+    # Снимок rebuild() затёр запись регистрации: в рейтинге 3, в бд уже 5.
+    await redis_client.zadd(LEADERBOARD_KEY, {"1": 3})
+
+    await service.record_referral(1, 6)
+    assert await redis_client.zscore(LEADERBOARD_KEY, "1") == 6
+
+    # Запоздавшая запись меньшего значения не откатывает счёт.
+    await service.record_referral(1, 4)
+    assert await redis_client.zscore(LEADERBOARD_KEY, "1") == 6
+
+
+async def test_rebuild_is_skipped_while_another_process_rebuilds(db, redis_client):
+    await redis_client.set(LEADERBOARD_REBUILD_LOCK_KEY, "other")
+    service = LeaderboardService(db, redis_client)
+
+    assert await service.rebuild() is None
+    await service.rebuild_if_missing()
+    assert not await redis_client.exists(LEADERBOARD_BUILT_KEY)
+    assert await redis_client.get(LEADERBOARD_REBUILD_LOCK_KEY) == b"other"
@@ -0,0 +1,79 @@
+import asyncio
+
+import fakeredis
+import pytest
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.services.referral_code_filter import ReferralCodeFilter, REFCODE_FILTER_KEY
+
+
+pytestmark = pytest.mark.anyio
+
+
+async def _wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.05)
+
+
+@pytest.fixture
+async def filters(engine):
+    """Два воркера с общим Redis и бд."""
+    server = fakeredis.FakeServer()
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    workers = []
+    for _ in range(2):
+        redis_client = fakeredis.FakeAsyncRedis(server=server)
+        refcode_filter = ReferralCodeFilter(
+            capacity=1000, error_rate=0.01, redis_mirror=True,
+            session_factory=session_factory,
+        )
+        refcode_filter.start(redis_client)
+        workers.append((refcode_filter, redis_client))
+
+    async def ready():
+        return all(refcode_filter.ready for refcode_filter, _ in workers)
+    await _wait_for(ready)
+    yield workers
+    for refcode_filter, redis_client in workers:
+        await refcode_filter.stop()
+        await redis_client.aclose()
+
+
+async def test_added_code_is_seen_by_other_worker(filters, create_code):
+    (first, first_redis), (second, second_redis) = filters
+    await create_code("welcome")
+    await first.add("welcome", first_redis)
+
+    assert await second.might_exist("welcome", second_redis)
+    assert not await second.might_exist("missing", second_redis)
+
+
+async def test_failed_add_rebuilds_other_workers(filters, create_code, monkeypatch):
+    (first, first_redis), (second, second_redis) = filters
+    await create_code("welcome")
+
+    pipeline = first_redis.pipeline
+    calls = 0
+
+    def failing_pipeline(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise RedisError("connection lost")
+        return pipeline(*args, **kwargs)
+
+    monkeypatch.setattr(first_redis, "pipeline", failing_pipeline)
+    await first.add("welcome", first_redis)
+
+    assert await first.might_exist("welcome", first_redis)
+
+    async def seen_by_second():
+        return second.ready and await second.might_exist("welcome", second_redis)
+    await _wait_for(seen_by_second)
+
+    async def mirror_rebuilt():
+        return await second_redis.exists(REFCODE_FILTER_KEY)
+    await _wait_for(mirror_rebuilt)
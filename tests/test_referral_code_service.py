@@ -0,0 +1,71 @@
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app.services import referral_code_service
+from app.services.referral_code_service import ReferralCodeService
+
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_activate_referral_code(db, create_user, create_code):
+    owner = await create_user("owner@example.com")
+    referral_code = await create_code("welcome", owner)
+
+    activated = await ReferralCodeService(db).activate_referral_code(referral_code.id, owner.id)
+
+    assert activated.id == referral_code.id
+    assert activated.active
+
+
+async def test_activate_missing_referral_code(db, create_user):
+    owner = await create_user("owner@example.com")
+    with pytest.raises(LookupError):
+        await ReferralCodeService(db).activate_referral_code(404, owner.id)
+
+
+async def test_activate_foreign_referral_code(db, create_user, create_code):
+    owner = await create_user("owner@example.com")
+    stranger = await create_user("stranger@example.com")
+    referral_code = await create_code("welcome", owner)
+
+    with pytest.raises(PermissionError):
+        await ReferralCodeService(db).activate_referral_code(referral_code.id, stranger.id)
+
+
+async def test_activate_expired_referral_code(db, create_user, create_code):
+    owner = await create_user("owner@example.com")
+    referral_code = await create_code("welcome", owner, days=-1)
+
+    with pytest.raises(ValueError):
+        await ReferralCodeService(db).activate_referral_code(referral_code.id, owner.id)
+
+
+async def test_activate_second_referral_code(db, create_user, create_code):
+    owner = await create_user("owner@example.com")
+    await create_code("welcome", owner, active=True)
+    referral_code = await create_code("welcome-again", owner)
+
+    with pytest.raises(ValueError):
+        await ReferralCodeService(db).activate_referral_code(referral_code.id, owner.id)
+
+
+async def test_referrer_code_lookup_drops_negative_entry_on_invalidate(
+    db, redis_client, create_user, create_code, monkeypatch
+):
+    @asynccontextmanager
+    async def test_session():
+        yield db
+
+    monkeypatch.setattr(referral_code_service, "AsyncSessionLocal", test_session)
+    owner = await create_user("referrer-lookup@example.com")
+    service = ReferralCodeService(db, redis_client)
+
+    assert await service.get_referral_code_by_referrer_email(owner.email) is None
+    referral_code = await create_code("lookup", owner, active=True)
+    assert await service.get_referral_code_by_referrer_email(owner.email) is None
+    await service.clear_referrer_email_cache(owner.email)
+    found = await service.get_referral_code_by_referrer_email(owner.email)
+
+    assert found is not None and found.code == referral_code.code
@@ -0,0 +1,89 @@
+import pytest
+
+from app.models.user import User
+from app.services.referral_tree_service import ReferralTreeService
+
+
+pytestmark = pytest.mark.anyio
+
+
+async def _create_user(db, email: str, invited_by: User | None = None) -> User:
+    user = User(
+        email=email, hashed_password="x", invited_by_id=invited_by.id if invited_by else None
+    )
+    db.add(user)
+    await db.flush()
+    await ReferralTreeService(db).add_user(user.id, user.invited_by_id)
+    await db.commit()
+    return user
+
+
+async def _create_chain(db) -> list[User]:
+    """root <- child <- grandchild"""
+    root = await _create_user(db, "root@example.com")
+    child = await _create_user(db, "child@example.com", root)
+    grandchild = await _create_user(db, "grandchild@example.com", child)
+    return [root, child, grandchild]
+
+
+async def test_add_user_builds_closure(db):
+    root, child, grandchild = await _create_chain(db)
+    service = ReferralTreeService(db)
+
+    tree = await service.get_descendants(root.id, max_depth=10, limit=10)
+    assert [(node.id, node.depth) for node in tree.descendants] == [
+        (child.id, 1), (grandchild.id, 2)
+    ]
+    assert not tree.truncated
+
+    ancestors = await service.get_ancestors(grandchild.id)
+    assert [(node.id, node.depth) for node in ancestors.ancestors] == [
+        (child.id, 1), (root.id, 2)
+    ]
+
+
+async def test_add_users_matches_add_user(db):
+    root, child, _ = await _create_chain(db)
+    imported = [
+        User(email="a@example.com", hashed_password="x", invited_by_id=child.id),
+        User(email="b@example.com", hashed_password="x", invited_by_id=root.id),
+        User(email="c@example.com", hashed_password="x"),
+    ]
+    db.add_all(imported)
+    await db.flush()
+    service = ReferralTreeService(db)
+    await service.add_users([user.id for user in imported])
+    await db.commit()
+
+    assert (await service.get_subtree_size(root.id)).subtree_size == 4
+    assert (await service.get_subtree_size(child.id)).subtree_size == 2
+    assert (await service.get_subtree_size(imported[2].id)).subtree_size == 0
+    ancestors = await service.get_ancestors(imported[0].id)
+    assert [(node.id, node.depth) for node in ancestors.ancestors] == [
+        (child.id, 1), (root.id, 2)
+    ]
+
+
+async def test_add_users_without_users(db):
+    await ReferralTreeService(db).add_users([])
+
+
+async def test_get_subtree_size_with_max_depth(db):
+    root, _, _ = await _create_chain(db)
+    service = ReferralTreeService(db)
+
+    assert (await service.get_subtree_size(root.id)).subtree_size == 2
+    assert (await service.get_subtree_size(root.id, max_depth=1)).subtree_size == 1
+    assert (await service.get_subtree_size(root.id, max_depth=0)).subtree_size == 0
+
+
+async def test_get_subtree_size_of_missing_user(db):
+    with pytest.raises(ValueError):
+        await ReferralTreeService(db).get_subtree_size(404)
+
+
+async def test_get_descendants_truncated(db):
+    root, _, _ = await _create_chain(db)
+    tree = await ReferralTreeService(db).get_descendants(root.id, max_depth=10, limit=1)
+    assert len(tree.descendants) == 1
+    assert tree.truncated
@@ -0,0 +1,124 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.dependencies import get_current_user
+from app.core.redis import get_redis
+from app.db.session import get_db, get_read_db
+from app.main import app
+from app.models.user import User
+from app.schemas.auth import Principal
+from app.services.referral_code_service import (
+    ReferralCodeService,
+    decode_cursor,
+    encode_cursor,
+)
+
+
+async def _create_referrals(db, count: int) -> User:
+    referrer = User(email="referrer@example.com", hashed_password="x", invited_count=count)
+    db.add(referrer)
+    await db.flush()
+    db.add_all(
+        User(email=f"user{i}@example.com", hashed_password="x", invited_by_id=referrer.id)
+        for i in range(count)
+    )
+    await db.commit()
+    return referrer
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(42)) == 42
+
+
+@pytest.mark.parametrize("cursor", ["", "!!!", "aWQ6", "Zm9vOjE", "aWQ6YWJj", "/w"])
+def test_decode_cursor_rejects_bad_input(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor)
+
+
+def test_referrals_endpoint_rejects_bad_cursor():
+    async def no_db():
+        yield None
+
+    app.dependency_overrides[get_current_user] = lambda: Principal(id=1, email="a@example.com")
+    app.dependency_overrides[get_read_db] = no_db
+    app.dependency_overrides[get_redis] = lambda: None
+    try:
+        response = TestClient(app).get("/1/referrals", params={"cursor": "not-a-cursor"})
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_invalid_token_is_rejected_with_401():
+    async def no_db():
+        yield None
+
+    app.dependency_overrides[get_db] = no_db
+    app.dependency_overrides[get_read_db] = no_db
+    app.dependency_overrides[get_redis] = lambda: None
+    try:
+        response = TestClient(app).get(
+            "/1/referrals", headers={"Authorization": "Bearer not-a-jwt"}
+        )
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Invalid token"}
+
+
+def test_export_of_another_users_referrals_is_forbidden():
+    async def no_db():
+        yield None
+
+    app.dependency_overrides[get_current_user] = lambda: Principal(id=1, email="a@example.com")
+    app.dependency_overrides[get_read_db] = no_db
+    try:
+        response = TestClient(app).get("/2/referrals/export")
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 403
+
+
+@pytest.mark.anyio
+async def test_page_with_exactly_limit_rows_has_no_cursor(db):
+    referrer = await _create_referrals(db, 3)
+    page = await ReferralCodeService(db).get_invited_users_by_referrer_id(referrer.id, limit=3)
+    assert [user.email for user in page.invited_users] == [
+        "user0@example.com", "user1@example.com", "user2@example.com"
+    ]
+    assert page.next_cursor is None
+    assert page.total == 3
+
+
+@pytest.mark.anyio
+async def test_keyset_paging_walks_all_rows(db):
+    referrer = await _create_referrals(db, 5)
+    service = ReferralCodeService(db)
+
+    first = await service.get_invited_users_by_referrer_id(referrer.id, limit=2)
+    assert [user.email for user in first.invited_users] == [
+        "user0@example.com", "user1@example.com"
+    ]
+    assert first.next_cursor == encode_cursor(first.invited_users[-1].id)
+
+    second = await service.get_invited_users_by_referrer_id(
+        referrer.id, limit=2, after_id=decode_cursor(first.next_cursor)
+    )
+    assert [user.email for user in second.invited_users] == [
+        "user2@example.com", "user3@example.com"
+    ]
+    assert second.next_cursor is not None
+
+    last = await service.get_invited_users_by_referrer_id(
+        referrer.id, limit=2, after_id=decode_cursor(second.next_cursor)
+    )
+    assert [user.email for user in last.invited_users] == ["user4@example.com"]
+    assert last.next_cursor is None
+
+
+@pytest.mark.anyio
+async def test_referrals_of_missing_user(db):
+    with pytest.raises(ValueError):
+        await ReferralCodeService(db).get_invited_users_by_referrer_id(404, limit=2)
@@ -0,0 +1,56 @@
+import pytest
+
+from app.services.user_import_service import UserImportService, iter_lines
+
+
+pytestmark = pytest.mark.anyio
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.fixture
+def imported(monkeypatch):
+    """Строки, дошедшие до записи в бд: (номер строки, email)."""
+    rows = []
+
+    async def import_batch(self, batch):
+        rows.extend((line, row.email) for line, row in batch)
+    monkeypatch.setattr(UserImportService, "_import_batch", import_batch)
+    return rows
+
+
+async def test_iter_lines_splits_across_chunks():
+    lines = [line async for line in iter_lines(_chunks(b"a\r\nb", b"c\n", b"d"))]
+    assert lines == [b"a", b"bc", b"d"]
+
+
+async def test_import_reports_non_utf8_line(db, imported):
+    body = (
+        b'{"email": "a@example.com", "password": "secret"}\n'
+        b'{"email": "\xff@example.com", "password": "secret"}\n'
+        b'{"email": "b@example.com", "password": "secret"}\n'
+    )
+    report = await UserImportService(db).import_lines(iter_lines(_chunks(body)), "ndjson")
+
+    assert imported == [(1, "a@example.com"), (3, "b@example.com")]
+    assert report.failed == 1
+    assert report.errors[0].line == 2
+    assert "utf-8" in report.errors[0].error
+
+
+async def test_import_reports_bad_csv_rows(db, imported):
+    body = (
+        b"email,password\n"
+        b"a@example.com,secret\n"
+        b"not-an-email,secret\n"
+        b"a@example.com,secret\n"
+    )
+    report = await UserImportService(db).import_lines(iter_lines(_chunks(body)), "csv")
+
+    assert imported == [(2, "a@example.com")]
+    assert [(error.line, error.email) for error in report.errors] == [
+        (3, None), (4, "a@example.com")
+    ]
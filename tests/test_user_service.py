@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import func, select
+
+from app.models.user import User
+from app.schemas.referral_code import ReferralCodeResponse
+from app.schemas.user import UserCreateByRefCode
+from app.services.referral_code_service import ReferralCodeService
+from app.services.user_service import UserService
+
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_create_user_by_refcode(db, create_code):
+    referral_code = await create_code("welcome", active=True)
+
+    new_user = await UserService(db).create_user_by_refcode(
+        UserCreateByRefCode(email="new@example.com", password="secret", referral_code="welcome")
+    )
+
+    assert new_user.invited_by_id == referral_code.owner_id
+    owner = await db.get(User, referral_code.owner_id, populate_existing=True)
+    assert owner.invited_count == 1
+
+
+async def test_create_user_by_stale_refcode(db, create_code, monkeypatch):
+    referral_code = await create_code("welcome")
+    # Кеш разрешения кодов ещё помнит код активным.
+    stale = ReferralCodeResponse.model_validate(referral_code).model_copy(update={"active": True})
+
+    async def get_referral_code_by_code(self, code):
+        return stale
+    monkeypatch.setattr(
+        ReferralCodeService, "get_referral_code_by_code", get_referral_code_by_code
+    )
+
+    new_user = await UserService(db).create_user_by_refcode(
+        UserCreateByRefCode(email="new@example.com", password="secret", referral_code="welcome")
+    )
+
+    assert new_user is None
+    assert await db.scalar(select(func.count()).select_from(User)) == 1